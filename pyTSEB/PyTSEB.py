@@ -73,15 +73,26 @@ see the guidelines for input and configuration file preparation in :doc:`README_
 
 """
 
-from os.path import join, splitext, dirname, basename, exists
-from os import mkdir
-from collections import OrderedDict
+from os.path import join, splitext, dirname, basename, exists, relpath
+from os import mkdir, cpu_count
+from collections import OrderedDict, deque
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+import copy
 import math
+import multiprocessing
+from xml.sax.saxutils import escape
 
 from osgeo import gdal, ogr, osr
 import numpy as np
 import pandas as pd
 from netCDF4 import Dataset
+try:
+    import pyarrow  # noqa: F401, only used as the parsing engine of pandas
+    PYARROW = True
+except ImportError:
+    PYARROW = False
 
 from . import TSEB
 from . import meteo_utils as met
@@ -90,6 +101,7 @@ from . import resistances as res
 from . import clumping_index as CI
 from . import energy_combination_ET as pet
 from . import dis_TSEB
+from . import _tseb_kernel
 
 
 # Constants for indicating whether model output field should be saved to file
@@ -97,9 +109,328 @@ S_N = 0  # Save Not
 S_P = 1  # Save as Primary output
 S_A = 2  # Save as Ancillary output
 
+# Input columns required in the point time-series tables of each model
+TSEB_REQUIRED_COLUMNS = frozenset(('year', 'DOY', 'time', 'T_R1', 'VZA', 'T_A1', 'u', 'ea',
+                                   'S_dn', 'LAI', 'h_C'))
+DTD_REQUIRED_COLUMNS = frozenset(('year', 'DOY', 'time', 'T_R0', 'T_R1', 'VZA', 'T_A0', 'T_A1',
+                                  'u', 'ea', 'S_dn', 'LAI', 'h_C'))
+TSEB_2T_REQUIRED_COLUMNS = frozenset(('year', 'DOY', 'time', 'T_C', 'T_S', 'T_A1', 'u', 'ea',
+                                      'S_dn', 'LAI', 'h_C'))
+
+# Image input fields of TSEB_PT, with their descriptions
+TSEB_INPUT_STRUCTURE = MappingProxyType(OrderedDict([
+    # General parameters
+    ("T_R1", "Land Surface Temperature"),
+    ("LAI", "Leaf Area Index"),
+    ("VZA", "View Zenith Angle for LST"),
+    ("landcover", "Landcover"),
+    ("input_mask", "Input Mask"),
+    # Vegetation parameters
+    ("f_c", "Fractional Cover"),
+    ("h_C", "Canopy Height"),
+    ("w_C", "Canopy Width Ratio"),
+    ("f_g", "Green Vegetation Fraction"),
+    ("leaf_width", "Leaf Width"),
+    ("x_LAD", "Leaf Angle Distribution"),
+    ("alpha_PT", "Initial Priestley-Taylor Alpha Value"),
+    # Spectral Properties
+    ("rho_vis_C", "Leaf PAR Reflectance"),
+    ("tau_vis_C", "Leaf PAR Transmitance"),
+    ("rho_nir_C", "Leaf NIR Reflectance"),
+    ("tau_nir_C", "Leaf NIR Transmitance"),
+    ("rho_vis_S", "Soil PAR Reflectance"),
+    ("rho_nir_S", "Soil NIR Reflectance"),
+    ("emis_C", "Leaf Emissivity"),
+    ("emis_S", "Soil Emissivity"),
+    # Illumination conditions
+    ("lat", "Latitude"),
+    ("lon", "Longitude"),
+    ("stdlon", "Standard Longitude"),
+    ("time", "Observation Time for LST"),
+    ("DOY", "Observation Day Of Year for LST"),
+    ("SZA", "Sun Zenith Angle"),
+    ("SAA", "Sun Azimuth Angle"),
+    # Meteorological parameters
+    ("T_A1", "Air temperature"),
+    ("u", "Wind Speed"),
+    ("ea", "Vapour Pressure"),
+    ("alt", "Altitude"),
+    ("p", "Pressure"),
+    ("S_dn", "Shortwave Irradiance"),
+    ("z_T", "Air Temperature Height"),
+    ("z_u", "Wind Speed Height"),
+    ("z0_soil", "Soil Roughness"),
+    ("L_dn", "Longwave Irradiance"),
+    # Resistance parameters
+    ("KN_b", "Kustas and Norman Resistance Parameter b"),
+    ("KN_c", "Kustas and Norman Resistance Parameter c"),
+    ("KN_C_dash", "Kustas and Norman Resistance Parameter c-dash"),
+    # Soil heat flux parameter
+    ("G", "Soil Heat Flux Parameter"),
+    ('S_dn_24', 'Daily shortwave irradiance')]))
+
+# Output fields of TSEB_PT, with whether they are saved to the primary or ancillary outputs
+TSEB_OUTPUT_STRUCTURE = MappingProxyType(OrderedDict([
+    # Energy fluxes
+    ('R_n1', S_P),   # net radiation reaching the surface at time t1
+    ('R_ns1', S_A),  # net shortwave radiation reaching the surface at time t1
+    ('R_nl1', S_A),  # net longwave radiation reaching the surface at time t1
+    ('delta_R_n1', S_A),  # net radiation divergence in the canopy at time t1
+    ('Sn_S1', S_N),  # Shortwave radiation reaching the soil at time t1
+    ('Sn_C1', S_N),  # Shortwave radiation intercepted by the canopy at time t1
+    ('Ln_S1', S_N),  # Longwave radiation reaching the soil at time t1
+    ('Ln_C1', S_N),  # Longwave radiation intercepted by the canopy at time t1
+    ('H_C1', S_A),  # canopy sensible heat flux (W/m^2) at time t1
+    ('H_S1', S_N),  # soil sensible heat flux (W/m^2) at time t1
+    ('H1', S_P),  # total sensible heat flux (W/m^2) at time t1
+    ('LE_C1', S_A),  # canopy latent heat flux (W/m^2) at time t1
+    ('LE_S1', S_N),  # soil latent heat flux (W/m^2) at time t1
+    ('LE1', S_P),  # total latent heat flux (W/m^2) at time t1
+    ('LE_partition', S_A),  # Latent Heat Flux Partition (LEc/LE) at time t1
+    ('G1', S_P),  # ground heat flux (W/m^2) at time t1
+    # temperatures (might not be accurate)
+    ('T_C1', S_A),  # canopy temperature at time t1 (deg C)
+    ('T_S1', S_A),  # soil temperature at time t1 (deg C)
+    ('T_AC1', S_N),  # air temperature at the canopy interface at time t1 (deg C)
+    # resistances
+    # resistance to heat transport in the surface layer (s/m) at time t1
+    ('R_A1', S_A),
+    # resistance to heat transport in the canopy surface layer (s/m) at time t1
+    ('R_x1', S_A),
+    # resistance to heat transport from the soil surface (s/m) at time t1 fluxes
+    ('R_S1', S_A),
+    # miscaleneous
+    ('albedo1', S_N),    # surface albedo (Rs_out/Rs_in)
+    ('omega0', S_N),  # nadir view vegetation clumping factor
+    ('alpha', S_N),  # the priestly Taylor factor
+    ('Ri', S_N),  # Richardson number at time t1
+    ('L', S_A),  # Monin Obukhov Length at time t1
+    ('u_friction', S_A),  # Friction velocity
+    ('theta_s1', S_N),  # Sun zenith angle at time t1
+    ('F', S_N),  # Leaf Area Index
+    ('z_0M', S_N),  # Aerodynamic roughness length for momentum trasport (m)
+    ('d_0', S_N),  # Zero-plane displacement height (m)
+    ('Skyl', S_N),
+    ('flag', S_A),  # Quality flag
+    ('n_iterations', S_N)]))  # Number of iterations before model converged to stable value
+
+# Approximate number of pixels read and processed at once in image mode
+BLOCK_PIXELS = 2**20
+# GDAL configuration used in image mode, unless already set by the user
+GDAL_CONFIG_OPTIONS = {"GDAL_CACHEMAX": "512",
+                       "GDAL_DISABLE_READDIR_ON_OPEN": "TRUE",
+                       "GDAL_NUM_THREADS": "ALL_CPUS"}
+# Decompress the blocks of input rasters using all the available cores
+GDAL_OPEN_OPTIONS = ["NUM_THREADS=ALL_CPUS"]
+# Number of processes running image blocks in parallel. Each block being processed keeps its
+# inputs and outputs in memory, hence the limit
+BLOCK_PROCESSES = min(cpu_count() or 1, 4)
+# Tile size of the GeoTIFF to which output blocks are written while processing an image.
+# The file is only temporary, so it is compressed with the fastest deflate level. Tiles with no
+# valid pixels are not written, and are read back as no data from the sparse file
+OUTPUT_BLOCK_SIZE = 256
+OUTPUT_CREATION_OPTIONS = ['TILED=YES',
+                           'SPARSE_OK=TRUE',
+                           f'BLOCKXSIZE={OUTPUT_BLOCK_SIZE}',
+                           f'BLOCKYSIZE={OUTPUT_BLOCK_SIZE}',
+                           'COMPRESS=DEFLATE',
+                           'PREDICTOR=3',
+                           'ZLEVEL=1',
+                           'NUM_THREADS=ALL_CPUS',
+                           'BIGTIFF=IF_SAFER']
+# Saved outputs, as Cloud Optimized GeoTIFFs or as tiled GeoTIFFs if the COG driver is not
+# available. Floating point predictor and compression using all the available cores
+COG_CREATION_OPTIONS = ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'NUM_THREADS=ALL_CPUS',
+                        'BIGTIFF=IF_SAFER']
+GTIFF_CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3',
+                          'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+# netCDF outputs are written directly as netCDF4 variables, compressed with the fastest deflate
+# level and chunked as the output blocks so that each block is compressed only once
+NETCDF_VARIABLE_OPTIONS = {'zlib': True, 'complevel': 1, 'shuffle': True}
+# GDAL driver and creation options of the saved outputs by file extension. Outputs with any
+# other extension are saved as Cloud Optimized GeoTIFFs. netCDF outputs are not written by GDAL
+OUTPUT_DRIVERS = {".nc": ("netCDF", []),
+                  ".vrt": ("VRT", [])}
+
+
+def _read_input_table(input_file):
+    '''Read a whitespace delimited table of point inputs into a DataFrame.
+
+    Tab delimited files are parsed with the multithreaded pyarrow engine when
+    pyarrow is installed, otherwise with the default pandas parser.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to the text file with a header line of column names.
+
+    Returns
+    -------
+    in_data : pandas.DataFrame
+        Table with one column per field in the header.
+    '''
+
+    if PYARROW:
+        # The pyarrow engine only supports single character delimiters. Its result is only used
+        # if it has the same columns as the whitespace delimited header, which is not the case
+        # when the header also uses spaces as delimiters or has trailing tabs
+        with open(input_file) as fid:
+            header = fid.readline().split()
+        try:
+            in_data = pd.read_csv(input_file, sep='\t', engine='pyarrow')
+        except ValueError:
+            in_data = None
+        if in_data is not None and list(in_data.columns) == header:
+            return in_data
+    return pd.read_csv(input_file, delim_whitespace=True, index_col=False)
+
+
+def _init_output(fields, shape):
+    '''Allocate the NaN filled float32 arrays of the output dictionary.
+
+    All the fields are views into a single contiguous block of memory, with
+    the values of each field stored contiguously.
+
+    Parameters
+    ----------
+    fields : iterable
+        Names of the output fields.
+    shape : tuple
+        Shape of each output array.
+
+    Returns
+    -------
+    out_data : dict
+        Output arrays keyed by field name.
+    '''
+
+    fields = list(fields)
+    block = np.full((len(fields),) + tuple(shape), np.NaN, np.float32)
+    return dict(zip(fields, block))
+
+
+def _init_block_process(threads):
+    ''' Share the cores among the worker processes of :meth:`PyTSEB.process_local_image`, by
+    limiting the threads used by the compiled kernels in each of them.'''
+    _tseb_kernel.set_num_threads(threads)
+
+
+def _run_block(model, in_data, mask, fields):
+    ''' Run a model on an image block, in a worker process of :meth:`PyTSEB.process_local_image`.
+    Only the output fields which are saved are sent back to the main process.'''
+    out_data = model.run(in_data, mask)
+    return {field: out_data[field] for field in fields}
+
+
+def _save_band(src_file, band, out_path):
+    ''' Save a band of a raster file as a single band Cloud Optimized GeoTIFF, or as a GeoTIFF if
+    the COG driver is not available. Bands are saved in parallel threads, see
+    :meth:`PyTSEB._close_raster_output`, so each file is compressed in a single thread.'''
+    out_ds = gdal.Translate(out_path, src_file, format="COG",
+                            creationOptions=_single_threaded(COG_CREATION_OPTIONS),
+                            bandList=[band], noData=None, stats=True)
+    # If GDAL drivers for other formats do not exist then default to GeoTiff
+    if out_ds is None:
+        gdal.Translate(out_path, src_file, format="GTiff",
+                       creationOptions=_single_threaded(GTIFF_CREATION_OPTIONS),
+                       bandList=[band], noData=None, stats=True)
+    out_ds = None
+
+
+def _build_vrt(out_vrt, out_files, fields, ds):
+    ''' Write a Virtual Raster Table stacking single band rasters with the same size, geo transform
+    and projection as the dataset ds. The XML is written directly, as gdal.BuildVRT would open
+    every file to read properties which are already known.'''
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+    window = f'xOff="0" yOff="0" xSize="{cols}" ySize="{rows}"'
+    xml = [f'<VRTDataset rasterXSize="{cols}" rasterYSize="{rows}">',
+           f'  <SRS>{escape(ds.GetProjection())}</SRS>',
+           '  <GeoTransform>{}</GeoTransform>'.format(
+               ', '.join(repr(float(g)) for g in ds.GetGeoTransform()))]
+    for i, (out_file, field) in enumerate(zip(out_files, fields)):
+        xml += [f'  <VRTRasterBand dataType="Float32" band="{i + 1}">',
+                f'    <Description>{escape(field)}</Description>',
+                '    <SimpleSource>',
+                '      <SourceFilename relativeToVRT="1">{}</SourceFilename>'.format(
+                    escape(relpath(out_file, dirname(out_vrt) or '.'))),
+                '      <SourceBand>1</SourceBand>',
+                f'      <SrcRect {window} />',
+                f'      <DstRect {window} />',
+                '    </SimpleSource>',
+                '  </VRTRasterBand>']
+    xml.append('</VRTDataset>')
+    with open(out_vrt, 'w') as fid:
+        fid.write('\n'.join(xml) + '\n')
+
+
+def _create_netcdf(outfile, dims, fields, geo, prj):
+    ''' Create a netCDF4 file with one float32 variable per output field, georeferenced with a
+    grid mapping variable understood both by CF readers and by GDAL.'''
+    rows, cols = dims
+    ds = Dataset(outfile, 'w', format='NETCDF4')
+    srs = osr.SpatialReference(wkt=prj)
+    if srs.IsGeographic():
+        y_name, x_name = 'lat', 'lon'
+        y_attrs = {'standard_name': 'latitude', 'units': 'degrees_north'}
+        x_attrs = {'standard_name': 'longitude', 'units': 'degrees_east'}
+    else:
+        y_name, x_name = 'y', 'x'
+        units = srs.GetLinearUnitsName()
+        y_attrs = {'standard_name': 'projection_y_coordinate', 'units': units}
+        x_attrs = {'standard_name': 'projection_x_coordinate', 'units': units}
+    ds.createDimension(y_name, rows)
+    ds.createDimension(x_name, cols)
+    # Coordinates of the pixel centres
+    for name, size, offset, step, attrs in [(y_name, rows, geo[3], geo[5], y_attrs),
+                                            (x_name, cols, geo[0], geo[1], x_attrs)]:
+        var = ds.createVariable(name, 'f8', (name,))
+        var.setncatts(attrs)
+        var[:] = offset + step * (np.arange(size) + 0.5)
+    crs = ds.createVariable('crs', 'c')
+    crs.spatial_ref = prj
+    crs.crs_wkt = prj
+    crs.GeoTransform = ' '.join(repr(float(g)) for g in geo)
+    chunks = (min(OUTPUT_BLOCK_SIZE, rows), min(OUTPUT_BLOCK_SIZE, cols))
+    for field in fields:
+        var = ds.createVariable(field, 'f4', (y_name, x_name), fill_value=np.float32(np.NaN),
+                                chunksizes=chunks, **NETCDF_VARIABLE_OPTIONS)
+        var.grid_mapping = 'crs'
+    return ds
+
+
+def _valid_windows(stack):
+    ''' Windows (xoff, yoff, xsize, ysize) of a block of outputs which have to be written. Output
+    tiles in which all the fields are NaN, e.g. masked water or clouds, are skipped as they are
+    read back as no data. The whole block is a single window if none of its tiles is skipped.'''
+    rows, cols = stack.shape[1:]
+    empty = np.isnan(stack).all(axis=0)
+    windows = [(x, y, min(OUTPUT_BLOCK_SIZE, cols - x), min(OUTPUT_BLOCK_SIZE, rows - y))
+               for y in range(0, rows, OUTPUT_BLOCK_SIZE)
+               for x in range(0, cols, OUTPUT_BLOCK_SIZE)
+               if not empty[y:y + OUTPUT_BLOCK_SIZE, x:x + OUTPUT_BLOCK_SIZE].all()]
+    if len(windows) == math.ceil(rows / OUTPUT_BLOCK_SIZE) * math.ceil(cols / OUTPUT_BLOCK_SIZE):
+        return [(0, 0, cols, rows)]
+    return windows
+
+
+def _single_threaded(options):
+    ''' Creation options with compression in a single thread.'''
+    return [opt for opt in options if not opt.startswith('NUM_THREADS=')] + ['NUM_THREADS=1']
+
+
+def _subset_model_params(model_params, i):
+    ''' Select the pixels i of the soil heat flux and resistance parameters of a model run.'''
+    G_form, G_param = model_params["calcG_params"]
+    res_form, res_params = model_params["resistance_form"]
+    return {"calcG_params": [G_form, G_param[i]],
+            "resistance_form": [res_form, {k: v[i] for k, v in res_params.items()}]}
+
 
 class PyTSEB(object):
 
+    # Whether the flux models solve the whole image at once, regardless of the pixels selected
+    SOLVES_WHOLE_IMAGE = False
+
     def __init__(self, parameters):
         self.p = parameters
 
@@ -110,48 +441,88 @@ class PyTSEB(object):
         self.G_form = self.p['G_form']
         self.water_stress = self.p['water_stress']
         self.calc_daily_ET = False
+        # Rasters kept open while processing an image
+        self._rasters = dict()
+        # Input and output structures already built, see _get_structure
+        self._structures = dict()
+
+    def __getstate__(self):
+        # Open GDAL datasets cannot be pickled, and are not needed to run the model
+        state = self.__dict__.copy()
+        state['_rasters'] = dict()
+        return state
+
+    def _get_structure(self, method):
+        ''' Input or output structure of the model, built only once.
+
+        Parameters
+        ----------
+        method : bound method
+            :meth:`_get_input_structure` or :meth:`_get_output_structure`.
+
+        Returns
+        -------
+        structure : ordered dict
+            The structure returned by method. It is shared between calls and must not be modified.
+        '''
+
+        # The structures also depend on the optional outputs being enabled
+        key = (method.__name__, self.calc_daily_ET, self.water_stress)
+        if key not in self._structures:
+            self._structures[key] = method()
+        return self._structures[key]
 
     def process_local_image(self):
         ''' Prepare input data and calculate energy fluxes for all the pixel in an image.
 
+        The image is processed in blocks (see :meth:`_iter_blocks`) so that only the inputs and
+        outputs of a few blocks are held in memory at a time. The outputs of each block are
+        written to the output files as soon as they are calculated, so unlike in
+        :meth:`process_point_series_array` the input and output data are not returned.
+        Blocks are run in parallel in spawned processes (see BLOCK_PROCESSES), so scripts calling
+        this method must do so within an ``if __name__ == '__main__':`` block.
+
         Parameters
         ----------
         None
 
         Returns
         -------
-        in_data : dict
-            All the input data coming into the model.
-        out_data : dict
-            All the output data coming out of the model.
+        None
         '''
 
+        # GDAL options which are not already set by the user are only changed while processing
+        config = {option: value for option, value in GDAL_CONFIG_OPTIONS.items()
+                  if gdal.GetConfigOption(option) is None}
+        with gdal.config_options(config):
+            self._process_local_image()
+        return None
+
+    def _process_local_image(self):
+        ''' Read, process and write an image block by block, see :meth:`process_local_image`.'''
+
         # ======================================
         # Process the input
 
-        # Create an input dictionary
-        in_data = dict()
-        temp_data = dict()
-        res_params = dict()
-        input_fields = self._get_input_structure()
+        input_fields = self._get_structure(self._get_input_structure)
+        self._rasters = dict()
 
         # Get projection, geo transform of the input dataset, or its subset if specified.
         # It is assumed that all the input rasters have exactly the same projection, dimensions and
         # resolution.
         try:
             field = list(input_fields)[0]
-            fid = gdal.Open(self.p[field], gdal.GA_ReadOnly)
+            fid = self._open_raster(self.p[field])
             self.prj = fid.GetProjection()
             self.geo = fid.GetGeoTransform()
             dims = (fid.RasterYSize, fid.RasterXSize)
-            fid = None
             self.subset = []
             if "subset" in self.p:
                 self.subset, self.geo = self._get_subset(self.p["subset"], self.prj, self.geo)
                 if self.subset[3] <= 0 or self.subset[2] <= 0 or\
                    self.subset[0] >= dims[1] or self.subset[1] >= dims[0]:
                     print("ERROR: Requested subset does not intersect the data extent.")
-                    return
+                    return None
                 if self.subset[1] + self.subset[3] > dims[0] or\
                    self.subset[0] + self.subset[2] > dims[1]:
                     print("WARNING: Requested subset extends beyond the data extent.")
@@ -160,47 +531,230 @@ class PyTSEB(object):
                 dims = (self.subset[3], self.subset[2])
         except KeyError:
             print('Error reading ' + input_fields[field])
+            return None
+        extent = self.subset if self.subset else [0, 0, dims[1], dims[0]]
+
+        # ======================================
+        # Read, run the chosen model and write the outputs one block at a time
+
+        # Blocks are independent, so they are run in parallel by a pool of processes while the
+        # main process reads the inputs. The outputs are written by a separate thread, as GDAL
+        # releases the GIL while reading and compressing. The worker processes are spawned
+        # rather than forked, so they do not inherit the open GDAL datasets nor the threads of
+        # the main process, and any raster they need is opened by themselves
+        G_param = self.G_form[1]
+        out_ds = []
+        blocks = list(self._iter_blocks(fid, dims))
+        processes = min(BLOCK_PROCESSES, len(blocks))
+        if processes > 1:
+            pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_block_process,
+                                       initargs=((cpu_count() or 1) // processes,))
+        else:
+            pool = nullcontext()
+        # netCDF outputs are written with libhdf5, which is not thread safe and may also be used
+        # by GDAL to read the inputs, so they are written by the main process between reads
+        if OUTPUT_DRIVERS.get(splitext(self.p['output_file'])[1].lower(),
+                              ("COG",))[0] == "netCDF":
+            write_thread = nullcontext()
+        else:
+            write_thread = ThreadPoolExecutor(1)
+        pending = deque()
+        writes = deque()
+        try:
+            with pool as executor, write_thread as writer:
+                for n, (xoff, yoff, xsize, ysize) in enumerate(blocks):
+                    window = [extent[0] + xoff, extent[1] + yoff, xsize, ysize]
+                    # The G parameter is replaced by its array when reading each block, in a new
+                    # list so that the blocks already submitted keep their own
+                    self.G_form = [self.G_form[0], G_param]
+                    in_data, mask = self._read_input_block(input_fields, window)
+                    if in_data is None:
+                        return None
+
+                    # The output fields depend on which inputs were found, so the output
+                    # files are created once the first block has been read
+                    if not out_ds:
+                        outputs = self._get_output_files()
+                        for outfile, fields in outputs:
+                            out_ds.append(self._create_raster_output(outfile, dims, fields))
+                        saved_fields = [field for _, fields in outputs for field in fields]
+
+                    if executor is None:
+                        out_data = self.run(in_data, mask)
+                    else:
+                        out_data = executor.submit(_run_block, copy.copy(self), in_data, mask,
+                                                   saved_fields)
+                    pending.append((xoff, yoff, out_data))
+
+                    # Write the oldest blocks, keeping at most one block per process in memory
+                    while pending and (len(pending) >= max(processes, 1)
+                                       or n == len(blocks) - 1):
+                        block_xoff, block_yoff, out_data = pending.popleft()
+                        if executor is not None:
+                            out_data = out_data.result()
+                        if writer is None:
+                            self._write_output_blocks(out_ds, outputs, out_data, block_xoff,
+                                                      block_yoff)
+                        else:
+                            writes.append(writer.submit(self._write_output_blocks, out_ds,
+                                                        outputs, out_data, block_xoff,
+                                                        block_yoff))
+                        # At most one block waits to be written while the next one is read
+                        while len(writes) > 1:
+                            writes.popleft().result()
+                while writes:
+                    writes.popleft().result()
+
+            # ======================================
+            # Save output files
+
             fid = None
-            return
+            self._rasters = dict()
+            for outfile, fields in outputs:
+                self._close_raster_output(out_ds.pop(0), outfile, fields)
+            print('Saved Files')
+        finally:
+            # Outputs left unsaved by an error or by a missing input are discarded
+            fid = None
+            self._rasters = dict()
+            while out_ds:
+                self._discard_raster_output(out_ds.pop())
+
+        return None
+
+    def _get_output_files(self):
+        ''' Output files of the image processing and the fields saved in each of them.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        outputs : list of (string, string list) tuples
+            Path to the primary and ancillary output files and the names of their fields.
+        '''
+
+        # Output variables to be saved in images
+        all_fields = self._get_structure(self._get_output_structure)
+        primary_fields = [field for field, save in all_fields.items() if save == S_P]
+        ancillary_fields = [field for field, save in all_fields.items() if save == S_A]
+        print(primary_fields)
+        outdir = dirname(self.p['output_file'])
+        if not exists(outdir):
+            mkdir(outdir)
+        outputfile = splitext(self.p['output_file'])[0] + '_ancillary' + \
+                     splitext(self.p['output_file'])[1]
+        return [(self.p['output_file'], primary_fields), (outputfile, ancillary_fields)]
+
+    def _iter_blocks(self, fid, dims):
+        ''' Windows in which an image is read, processed and written.
+
+        The sides of the windows are multiples of both the input raster block size and the output
+        tile size, so that each block of the input and output files is read or written only once.
+        Windows span whole rows, unless a single row of blocks has more than BLOCK_PIXELS pixels,
+        in which case rows are split into tiles. If a window aligned with both block sizes would
+        have more than BLOCK_PIXELS pixels, e.g. for input blocks whose size is not a power of
+        two or for single row strips, the windows are only aligned with the output tiles.
+
+        Parameters
+        ----------
+        fid : GDAL dataset
+            Raster whose block size is used to align the windows.
+        dims : int list
+            The dimensions (rows, columns) of the processed image.
+
+        Yields
+        ------
+        window : int tuple
+            Offset and size (xoff, yoff, xsize, ysize) of the window within the processed image.
+        '''
+
+        block_cols, block_rows = fid.GetRasterBand(1).GetBlockSize()
+        block_cols = min(int(np.lcm(max(block_cols, 1), OUTPUT_BLOCK_SIZE)), dims[1])
+        block_rows = min(int(np.lcm(max(block_rows, 1), OUTPUT_BLOCK_SIZE)), dims[0])
+        if block_cols * block_rows > BLOCK_PIXELS:
+            block_cols = min(OUTPUT_BLOCK_SIZE, dims[1])
+        if block_cols * block_rows > BLOCK_PIXELS:
+            block_rows = min(OUTPUT_BLOCK_SIZE, dims[0])
+        cols = dims[1]
+        if cols * block_rows > BLOCK_PIXELS:
+            cols = min(max(BLOCK_PIXELS // (block_rows * block_cols), 1) * block_cols, cols)
+        rows = max(BLOCK_PIXELS // (cols * block_rows), 1) * block_rows
+        for yoff in range(0, dims[0], rows):
+            for xoff in range(0, dims[1], cols):
+                yield xoff, yoff, min(cols, dims[1] - xoff), min(rows, dims[0] - yoff)
+
+    def _read_input_block(self, input_fields, window):
+        ''' Read all the input fields for an image window.
+
+        Parameters
+        ----------
+        input_fields : string ordered dict
+            Names (keys) and descriptions (values) of the input fields.
+        window : int list
+            Offset and size (xoff, yoff, xsize, ysize) of the window within the input rasters.
+
+        Returns
+        -------
+        in_data : dict
+            All the input data coming into the model, or None if a required input is missing.
+        mask : int array
+            Pixels for which fluxes are calculated.
+        '''
+
+        # Create an input dictionary. The fields set by _set_param_array are views into a single
+        # float32 block, into which the rasters are read directly
+        in_data = dict()
+        temp_data = dict()
+        res_params = dict()
+        mask = None
+        dims = (window[3], window[2])
+        block = np.empty((len(input_fields),) + dims, np.float32)
 
         # Process all input fields
-        for field in list(input_fields):
+        for k, field in enumerate(input_fields):
             # Some fields might need special treatment
             if field in ["lat", "lon", "stdlon", "DOY", "time"]:
-                success, temp_data[field] = self._set_param_array(field, dims)
+                success, temp_data[field] = self._set_param_array(field, dims, out=block[k],
+                                                                  window=window)
             elif field == "input_mask":
                 if self.p['input_mask'] == '0':
                     # Create mask from landcover array
-                    mask = np.ones(dims, np.int32)
-                    mask[np.logical_or.reduce((in_data['landcover'] == res.WATER,
-                                               in_data['landcover'] == res.URBAN,
-                                               in_data['landcover'] == res.SNOW))] = 0
+                    mask = np.isin(in_data['landcover'], (res.WATER, res.URBAN, res.SNOW),
+                                   invert=True).astype(np.uint8)
                     success = True
                 else:
-                    success, mask = self._set_param_array(field, dims)
+                    success, mask = self._set_param_array(field, dims, out=block[k],
+                                                          window=window)
             elif field in ['KN_b', 'KN_c', 'KN_c_dash']:
-                success, res_params[field] = self._set_param_array(field, dims)
+                success, res_params[field] = self._set_param_array(field, dims, out=block[k],
+                                                                   window=window)
             elif field == "G":
                 # Get the Soil Heat flux if G_form includes the option of
                 # Constant G or constant ratio of soil reaching radiation
                 if self.G_form[0][0] == TSEB.G_CONSTANT or self.G_form[0][0] == TSEB.G_RATIO:
-                    success, self.G_form[1] = self._set_param_array(self.G_form[1], dims)
+                    success, self.G_form[1] = self._set_param_array(self.G_form[1], dims,
+                                                                    window=window)
                 # Santanello and Friedls G
                 elif self.G_form[0][0] == TSEB.G_TIME_DIFF:
                     # Set the time in the G_form flag to compute the Santanello and
                     # Friedl G
-                    self.G_form[1] = self._set_param_array("time", dims)[1]
+                    self.G_form[1] = self._set_param_array("time", dims, window=window)[1]
             elif field == 'S_dn_24':
-                success, in_data[field] = self._set_param_array(field, dims)
+                success, in_data[field] = self._set_param_array(field, dims, out=block[k],
+                                                                window=window)
                 if success:
                     self.calc_daily_ET = True
             else:
                 # Model specific fields which might need special treatment
-                success, inputs = self._set_special_model_input(field, dims)
+                success, inputs = self._set_special_model_input(field, dims, window)
                 if success:
                     in_data.update(inputs)
                 else:
-                    success, in_data[field] = self._set_param_array(field, dims)
+                    success, in_data[field] = self._set_param_array(field, dims, out=block[k],
+                                                                    window=window)
 
             if not success:
                 # Some fields are optional is some circumstances or can be calculated if missing.
@@ -215,7 +769,7 @@ class PyTSEB(object):
                     except KeyError as e:
                         print("ERROR: Cannot calculate or read {}. {} or parameter {} are missing."
                               .format(input_fields[field], field, e))
-                        return
+                        return None, None
                 elif field == "p":
                     print("Estimating missing %s parameter" % field)
                     try:
@@ -223,7 +777,7 @@ class PyTSEB(object):
                     except KeyError as e:
                         print("ERROR: Cannot calculate or read {}. {} or parameter {} are missing."
                               .format(input_fields[field], field, e))
-                        return
+                        return None, None
                 elif field == "L_dn":
                     print("Estimating missing %s parameter" % field)
                     try:
@@ -234,14 +788,14 @@ class PyTSEB(object):
                     except KeyError as e:
                         print("ERROR: Cannot calculate or read {}. {} or parameter {} are missing."
                               .format(input_fields[field], field, e))
-                        return
+                        return None, None
                 elif (field in ['KN_b', 'KN_c', 'KN_c_dash']
                       and self.resistance_form != TSEB.KUSTAS_NORMAN_1999):
                     print("ERROR: Cannot read {}.".format(input_fields[field]))
-                    return
+                    return None, None
                 elif field == "input_mask":
                     print("Please set input_mask=0 for processing the whole image.")
-                    return
+                    return None, None
                 elif field == "S_dn_24":
                     print("Provide a valid S_dn_24 (Daily shortwave irradiance) "
                           "value if you want to estimate daily ET")
@@ -253,33 +807,9 @@ class PyTSEB(object):
                     print('ERROR: file read {}'.format(field))
                     print('Please type a valid filename or a numeric value for '
                           .format(input_fields[field]))
-                    return
-
-        temp_data = None
-
-        # ======================================
-        # Run the chosen model
-
-        out_data = self.run(in_data, mask)
-
-        # ======================================
-        # Save output files
-
-        # Output variables to be saved in images
-        all_fields = self._get_output_structure()
-        primary_fields = [field for field, save in all_fields.items() if save == S_P]
-        ancillary_fields = [field for field, save in all_fields.items() if save == S_A]
-        print(primary_fields)
-        outdir = dirname(self.p['output_file'])
-        if not exists(outdir):
-            mkdir(outdir)
-        self.write_raster_output(self.p['output_file'], out_data, primary_fields)
-        outputfile = splitext(self.p['output_file'])[0] + '_ancillary' + \
-                     splitext(self.p['output_file'])[1]
-        self.write_raster_output(outputfile, out_data, ancillary_fields)
-        print('Saved Files')
+                    return None, None
 
-        return in_data, out_data
+        return in_data, mask
 
     def process_point_series_array(self):
         ''' Prepare input data and calculate energy fluxes for all the dates in point time-series.
@@ -296,57 +826,33 @@ class PyTSEB(object):
             All the output data coming out of the model.
         '''
 
-        def compose_date(
-                years,
-                months=1,
-                days=1,
-                weeks=None,
-                hours=None,
-                minutes=None,
-                seconds=None,
-                milliseconds=None,
-                microseconds=None,
-                nanoseconds=None):
-            ''' Taken from http://stackoverflow.com/questions/34258892/converting-year-and-day-of-year-into-datetime-index-in-pandas'''
-            years = np.asarray(years) - 1970
-            months = np.asarray(months) - 1
-            days = np.asarray(days) - 1
-            types = ('<M8[Y]', '<m8[M]', '<m8[D]', '<m8[W]', '<m8[h]',
-                     '<m8[m]', '<m8[s]', '<m8[ms]', '<m8[us]', '<m8[ns]')
-            vals = (years, months, days, weeks, hours, minutes, seconds,
-                    milliseconds, microseconds, nanoseconds)
-            return sum(np.asarray(v, dtype=t) for t, v in zip(types, vals)
-                       if v is not None)
-
         # ======================================
         # Process the input
 
         # Read input data from CSV file
-        in_data = pd.read_csv(self.p['input_file'],
-                              delim_whitespace=True,
-                              index_col=False)
-        in_data.index = compose_date(
-            years=in_data['year'],
-            days=in_data['DOY'],
-            hours=in_data['time'],
-            minutes=in_data['time'] % 1 * 60)
+        in_data = _read_input_table(self.p['input_file'])
+        # Time stamps truncated to the minute
+        in_data.index = (pd.to_datetime(in_data['year'].astype(str), format='%Y')
+                         + pd.to_timedelta(in_data['DOY'] - 1, unit='D')
+                         + pd.to_timedelta(np.floor(in_data['time']), unit='h')
+                         + pd.to_timedelta(np.floor(in_data['time'] % 1 * 60), unit='min'))
 
         # Check if all the required columns are present
         required_columns = self._get_required_data_columns()
-        missing = set(required_columns) - (set(in_data.columns))
+        missing = frozenset(required_columns).difference(in_data.columns)
         if missing:
             print('ERROR: ' + str(list(missing)) + ' not found in file ' + self.p['input_file'])
             return None, None
 
         # Fill in data fields which might not be in the input file
-        if 'SZA' not in in_data.columns:
-            sza, _ = met.calc_sun_angles(self.p['lat'], self.p['lon'],
-                                         self.p['stdlon'], in_data['DOY'], in_data['time'])
-            in_data['SZA'] = sza
-        if 'SAA' not in in_data.columns:
-            _, saa = met.calc_sun_angles(self.p['lat'], self.p['lon'],
-                                         self.p['stdlon'], in_data['DOY'], in_data['time'])
-            in_data['SAA'] = saa
+        if 'SZA' not in in_data.columns or 'SAA' not in in_data.columns:
+            # Both angles come from the same solar geometry so compute them only once
+            sza, saa = met.calc_sun_angles(self.p['lat'], self.p['lon'],
+                                           self.p['stdlon'], in_data['DOY'], in_data['time'])
+            if 'SZA' not in in_data.columns:
+                in_data['SZA'] = sza
+            if 'SAA' not in in_data.columns:
+                in_data['SAA'] = saa
         if 'p' not in in_data.columns:
             # Estimate barometric pressure from the altitude if not included in the table
             in_data['p'] = met.calc_pressure(self.p['alt'])
@@ -395,9 +901,9 @@ class PyTSEB(object):
             if 'G' in in_data.columns:
                 self.G_form[1] = in_data['G']
             else:
-                self.G_form[1] = np.ones(dims) * self.G_form[1]
+                self.G_form[1] = np.full(dims, self.G_form[1], np.float32)
         elif self.G_form[0][0] == TSEB.G_RATIO:
-            self.G_form[1] = np.ones(dims) * self.G_form[1]
+            self.G_form[1] = np.full(dims, self.G_form[1], np.float32)
         elif self.G_form[0][0] == TSEB.G_TIME_DIFF:
             # Set the time in the G_form flag to compute the Santanello and
             # Friedl G
@@ -405,9 +911,9 @@ class PyTSEB(object):
 
         # Set the Kustas and Norman resistance parameters
         if self.resistance_form == 0:
-            self.res_params['KN_b'] = np.ones(dims) * self.p['KN_b']
-            self.res_params['KN_c'] = np.ones(dims) * self.p['KN_c']
-            self.res_params['KN_C_dash'] = np.ones(dims) * self.p['KN_C_dash']
+            self.res_params['KN_b'] = np.full(dims, self.p['KN_b'], np.float32)
+            self.res_params['KN_c'] = np.full(dims, self.p['KN_c'], np.float32)
+            self.res_params['KN_C_dash'] = np.full(dims, self.p['KN_C_dash'], np.float32)
 
         # ======================================
         # Run the chosen model
@@ -529,114 +1035,123 @@ class PyTSEB(object):
                         "resistance_form": [self.resistance_form, self.res_params]}
 
         if mask is None:
-            mask = np.ones(in_data['LAI'].shape, np.int32)
+            mask = np.ones(in_data['LAI'].shape, np.uint8)
 
         # Create the output dictionary
-        out_data = dict()
-        for field in self._get_output_structure():
-            out_data[field] = np.zeros(in_data['LAI'].shape, np.float32) + np.NaN
+        out_data = _init_output(self._get_structure(self._get_output_structure),
+                                in_data['LAI'].shape)
 
         # Esimate diffuse and direct irradiance
         difvis, difnir, fvis, fnir = rad.calc_difuse_ratio(
             in_data['S_dn'], in_data['SZA'], press=in_data['p'])
         out_data['fvis'] = fvis
         out_data['fnir'] = fnir
-        out_data['Skyl'] = difvis * fvis + difnir * fnir
-        out_data['S_dn_dir'] = in_data['S_dn'] * (1.0 - out_data['Skyl'])
-        out_data['S_dn_dif'] = in_data['S_dn'] * out_data['Skyl']
+        (out_data['Skyl'],
+         out_data['S_dn_dir'],
+         out_data['S_dn_dif']) = _tseb_kernel.calc_diffuse_split(in_data['S_dn'], difvis, difnir,
+                                                                 fvis, fnir)
 
         # ======================================
         # First process bare soil cases
 
-        noVegPixels = in_data['LAI'] <= 0
         noVegPixels = np.logical_or.reduce(
             (in_data['f_c'] <= 0.01,
              in_data['LAI'] <= 0,
              np.isnan(in_data['LAI'])))
         # in_data['LAI'][noVegPixels] = 0
         # in_data['f_c'][noVegPixels] = 0
-        i = np.array(np.logical_and(noVegPixels, mask == 1))
-
-        # Calculate roughness
-        out_data['z_0M'][i] = in_data['z0_soil'][i]
-        out_data['d_0'][i] = 0
-
-        # Net shortwave radition for bare soil
-        spectraGrdOSEB = out_data['fvis'] * \
-            in_data['rho_vis_S'] + out_data['fnir'] * in_data['rho_nir_S']
-        out_data['Sn_S1'][i] = (1. - spectraGrdOSEB[i]) * \
-            (out_data['S_dn_dir'][i] + out_data['S_dn_dif'][i])
-
-        # Other fluxes for bare soil
-        self._call_flux_model_soil(in_data, out_data, model_params, i)
-
-        # Set canopy fluxes to 0
-        out_data['Sn_C1'][i] = 0.0
-        out_data['Ln_C1'][i] = 0.0
-        out_data['LE_C1'][i] = 0.0
-        out_data['H_C1'][i] = 0.0
+        # Pixels to process and their split into bare soil and vegetation, computed only once
+        valid = np.asarray(mask == 1)
+        soil_pixels = noVegPixels & valid
+        veg_pixels = valid & ~soil_pixels
+        # The energy balance is only solved where the radiometric temperatures are valid, the
+        # fluxes of the other pixels are left as NaN and flagged as invalid
+        solved = np.logical_and.reduce([np.isfinite(in_data[field])
+                                        for field in self._get_temperature_fields()])
+        out_data['flag'][valid & ~solved] = TSEB.F_INVALID
+        i = soil_pixels
+        # Skip the soil models when there are no bare soil pixels to process
+        if np.any(i):
+            # Calculate roughness
+            out_data['z_0M'][i] = in_data['z0_soil'][i]
+            out_data['d_0'][i] = 0
+
+            # Net shortwave radition for bare soil
+            spectraGrdOSEB = out_data['fvis'] * \
+                in_data['rho_vis_S'] + out_data['fnir'] * in_data['rho_nir_S']
+            out_data['Sn_S1'][i] = (1. - spectraGrdOSEB[i]) * \
+                (out_data['S_dn_dir'][i] + out_data['S_dn_dif'][i])
+
+            # Other fluxes for bare soil
+            if np.any(i & solved):
+                self._call_flux_model_soil(in_data, out_data, model_params, i & solved)
+
+            # Set canopy fluxes to 0
+            out_data['Sn_C1'][i] = 0.0
+            out_data['Ln_C1'][i] = 0.0
+            out_data['LE_C1'][i] = 0.0
+            out_data['H_C1'][i] = 0.0
 
         # ======================================
         # Then process vegetated cases
 
-        i = np.array(np.logical_and(~noVegPixels, mask == 1))
-
-        # Calculate roughness
-        out_data['z_0M'][i], out_data['d_0'][i] = \
-            res.calc_roughness(in_data['LAI'][i],
-                               in_data['h_C'][i],
-                               w_C=in_data['w_C'][i],
-                               landcover=in_data['landcover'][i],
-                               f_c=in_data['f_c'][i])
-
-        # Net shortwave radiation for vegetation
-        F = np.zeros(in_data['LAI'].shape, np.float32)
-        F[i] = in_data['LAI'][i] / in_data['f_c'][i]
-        # Clumping index
-        omega0 = np.zeros(in_data['LAI'].shape, np.float32)
-        Omega = np.zeros(in_data['LAI'].shape, np.float32)
-        omega0[i] = CI.calc_omega0_Kustas(
-            in_data['LAI'][i],
-            in_data['f_c'][i],
-            x_LAD=in_data['x_LAD'][i],
-            isLAIeff=True)
-        if self.p['calc_row'][0] == 0:  # randomly placed canopies
-            Omega[i] = CI.calc_omega_Kustas(
-                omega0[i], in_data['SZA'][i], w_C=in_data['w_C'][i])
-        else:
-            Omega[i] = CI.calc_omega_Kustas(
-                omega0[i], in_data['SZA'][i], w_C=in_data['w_C'][i])
-        LAI_eff = F * Omega
-        [out_data['Sn_C1'][i],
-         out_data['Sn_S1'][i]] = rad.calc_Sn_Campbell(in_data['LAI'][i],
-                                                      in_data['SZA'][i],
-                                                      out_data['S_dn_dir'][i],
-                                                      out_data['S_dn_dif'][i],
-                                                      out_data['fvis'][i],
-                                                      out_data['fnir'][i],
-                                                      in_data['rho_vis_C'][i],
-                                                      in_data['tau_vis_C'][i],
-                                                      in_data['rho_nir_C'][i],
-                                                      in_data['tau_nir_C'][i],
-                                                      in_data['rho_vis_S'][i],
-                                                      in_data['rho_nir_S'][i],
-                                                      x_LAD=in_data['x_LAD'][i],
-                                                      LAI_eff=LAI_eff[i])
-
-        # Other fluxes for vegetation
-        self._call_flux_model_veg(in_data, out_data, model_params, i)
-
-        # Calculate the bulk fluxes
-        out_data['LE1'] = out_data['LE_C1'] + out_data['LE_S1']
-        out_data['LE_partition'] = out_data['LE_C1'] / out_data['LE1']
-        out_data['H1'] = out_data['H_C1'] + out_data['H_S1']
-        out_data['R_ns1'] = out_data['Sn_C1'] + out_data['Sn_S1']
-        out_data['R_nl1'] = out_data['Ln_C1'] + out_data['Ln_S1']
-        out_data['R_n1'] = out_data['R_ns1'] + out_data['R_nl1']
-        out_data['delta_R_n1'] = out_data['Sn_C1'] + out_data['Ln_C1']
-
-        if self.water_stress:
-            i = mask == 1
+        i = veg_pixels
+        # Skip the vegetation models when there are no vegetated pixels to process
+        if np.any(i):
+            # Gather the inputs used more than once only once for the vegetated pixels
+            LAI, f_c, SZA, x_LAD, w_C = [in_data[field][i] for field in
+                                         ['LAI', 'f_c', 'SZA', 'x_LAD', 'w_C']]
+
+            # Calculate roughness
+            out_data['z_0M'][i], out_data['d_0'][i] = \
+                res.calc_roughness(LAI,
+                                   in_data['h_C'][i],
+                                   w_C=w_C,
+                                   landcover=in_data['landcover'][i],
+                                   f_c=f_c)
+
+            # Net shortwave radiation for vegetation, only needed for the vegetated pixels
+            F = np.asarray(LAI / f_c, dtype=np.float32)
+            # Clumping index
+            omega0 = np.asarray(CI.calc_omega0_Kustas(LAI, f_c, x_LAD=x_LAD, isLAIeff=True),
+                                dtype=np.float32)
+            Omega = CI.calc_omega_Kustas(omega0, SZA, w_C=w_C)
+            LAI_eff = F * np.asarray(Omega, dtype=np.float32)
+            [out_data['Sn_C1'][i],
+             out_data['Sn_S1'][i]] = rad.calc_Sn_Campbell(LAI,
+                                                          SZA,
+                                                          out_data['S_dn_dir'][i],
+                                                          out_data['S_dn_dif'][i],
+                                                          out_data['fvis'][i],
+                                                          out_data['fnir'][i],
+                                                          in_data['rho_vis_C'][i],
+                                                          in_data['tau_vis_C'][i],
+                                                          in_data['rho_nir_C'][i],
+                                                          in_data['tau_nir_C'][i],
+                                                          in_data['rho_vis_S'][i],
+                                                          in_data['rho_nir_S'][i],
+                                                          x_LAD=x_LAD,
+                                                          LAI_eff=LAI_eff)
+
+        # Other fluxes for vegetation. Models which solve the whole image at once are always
+        # called, even when there are no vegetated pixels to solve
+        if self.SOLVES_WHOLE_IMAGE or np.any(i & solved):
+            self._call_flux_model_veg(in_data, out_data, model_params, i & solved)
+
+        # Calculate the bulk fluxes in place in the output arrays. The partition is left as NaN
+        # where there is no latent heat flux
+        np.add(out_data['LE_C1'], out_data['LE_S1'], out=out_data['LE1'])
+        np.divide(out_data['LE_C1'], out_data['LE1'], out=out_data['LE_partition'],
+                  where=out_data['LE1'] != 0)
+        np.add(out_data['H_C1'], out_data['H_S1'], out=out_data['H1'])
+        np.add(out_data['Sn_C1'], out_data['Sn_S1'], out=out_data['R_ns1'])
+        np.add(out_data['Ln_C1'], out_data['Ln_S1'], out=out_data['R_nl1'])
+        np.add(out_data['R_ns1'], out_data['R_nl1'], out=out_data['R_n1'])
+        np.add(out_data['Sn_C1'], out_data['Ln_C1'], out=out_data['delta_R_n1'])
+
+        if self.water_stress and np.any(valid):
+            i = valid
+            params = _subset_model_params(model_params, i)
             [_, _, _, _, _, _, out_data['LE_0'][i], _,
              out_data['LE_C_0'][i], _, _, _, _, _, _, _, _, _, _] = \
                  pet.shuttleworth_wallace(
@@ -662,11 +1177,8 @@ class PyTSEB(object):
                               x_LAD=in_data['x_LAD'][i],
                               Rst_min=self.p['Rst_min'],
                               R_ss=self.p['R_ss'],
-                              calcG_params=[model_params["calcG_params"][0],
-                                            model_params["calcG_params"][1][i]],
-                              resistance_form=[model_params["resistance_form"][0],
-                                               {k: model_params["resistance_form"][1][k][i]
-                                                   for k in model_params["resistance_form"][1]}])
+                              calcG_params=params["calcG_params"],
+                              resistance_form=params["resistance_form"])
 
             out_data['CWSI'][i] = 1.0 - (out_data['LE_C1'][i] / out_data['LE_C_0'][i])
 
@@ -695,41 +1207,37 @@ class PyTSEB(object):
         None
         '''
 
-        [out_data['flag'][i], out_data['T_S1'][i], out_data['T_C1'][i],
-         out_data['T_AC1'][i], out_data['Ln_S1'][i], out_data['Ln_C1'][i],
-         out_data['LE_C1'][i], out_data['H_C1'][i], out_data['LE_S1'][i],
-         out_data['H_S1'][i], out_data['G1'][i], out_data['R_S1'][i],
-         out_data['R_x1'][i], out_data['R_A1'][i], out_data['u_friction'][i],
-         out_data['L'][i], out_data['n_iterations'][i]] = TSEB.TSEB_PT(
-            in_data['T_R1'][i],
-            in_data['VZA'][i],
-            in_data['T_A1'][i],
-            in_data['u'][i],
-            in_data['ea'][i],
-            in_data['p'][i],
-            out_data['Sn_C1'][i],
-            out_data['Sn_S1'][i],
-            in_data['L_dn'][i],
-            in_data['LAI'][i],
-            in_data['h_C'][i],
-            in_data['emis_C'][i],
-            in_data['emis_S'][i],
-            out_data['z_0M'][i],
-            out_data['d_0'][i],
-            in_data['z_u'][i],
-            in_data['z_T'][i],
-            f_c=in_data['f_c'][i],
-            f_g=in_data['f_g'][i],
-            w_C=in_data['w_C'][i],
-            leaf_width=in_data['leaf_width'][i],
-            z0_soil=in_data['z0_soil'][i],
-            alpha_PT=in_data['alpha_PT'][i],
-            x_LAD=in_data['x_LAD'][i],
-            calcG_params=[model_params["calcG_params"][0],
-                          model_params["calcG_params"][1][i]],
-            resistance_form=[model_params["resistance_form"][0],
-                             {k: model_params["resistance_form"][1][k][i]
-                             for k in model_params["resistance_form"][1]}])
+        _tseb_kernel.TSEB_PT(
+            in_data['T_R1'],
+            in_data['VZA'],
+            in_data['T_A1'],
+            in_data['u'],
+            in_data['ea'],
+            in_data['p'],
+            out_data['Sn_C1'],
+            out_data['Sn_S1'],
+            in_data['L_dn'],
+            in_data['LAI'],
+            in_data['h_C'],
+            in_data['emis_C'],
+            in_data['emis_S'],
+            out_data['z_0M'],
+            out_data['d_0'],
+            in_data['z_u'],
+            in_data['z_T'],
+            f_c=in_data['f_c'],
+            f_g=in_data['f_g'],
+            w_C=in_data['w_C'],
+            leaf_width=in_data['leaf_width'],
+            z0_soil=in_data['z0_soil'],
+            alpha_PT=in_data['alpha_PT'],
+            x_LAD=in_data['x_LAD'],
+            calcG_params=model_params["calcG_params"],
+            resistance_form=model_params["resistance_form"],
+            mask=i,
+            out=[out_data[field] for field in
+                 ['flag', 'T_S1', 'T_C1', 'T_AC1', 'Ln_S1', 'Ln_C1', 'LE_C1', 'H_C1', 'LE_S1',
+                  'H_S1', 'G1', 'R_S1', 'R_x1', 'R_A1', 'u_friction', 'L', 'n_iterations']])
 
     def _call_flux_model_soil(self, in_data, out_data, model_params, i):
         ''' Call a OSEB model to calculate soil fluxes for data points containing no vegetation.
@@ -748,30 +1256,49 @@ class PyTSEB(object):
         None
         '''
 
-        [out_data['flag'][i],
-         out_data['Ln_S1'][i],
-         out_data['LE_S1'][i],
-         out_data['H_S1'][i],
-         out_data['G1'][i],
-         out_data['R_A1'][i],
-         out_data['u_friction'][i],
-         out_data['L'][i],
-         out_data['n_iterations'][i]] = TSEB.OSEB(in_data['T_R1'][i],
-                                                  in_data['T_A1'][i],
-                                                  in_data['u'][i],
-                                                  in_data['ea'][i],
-                                                  in_data['p'][i],
-                                                  out_data['Sn_S1'][i],
-                                                  in_data['L_dn'][i],
-                                                  in_data['emis_S'][i],
-                                                  out_data['z_0M'][i],
-                                                  out_data['d_0'][i],
-                                                  in_data['z_u'][i],
-                                                  in_data['z_T'][i],
-                                                  calcG_params=[model_params["calcG_params"][0],
-                                                                model_params["calcG_params"][1][i]])
-
-    def _set_param_array(self, parameter, dims, band=1):
+        _tseb_kernel.OSEB(in_data['T_R1'],
+                          in_data['T_A1'],
+                          in_data['u'],
+                          in_data['ea'],
+                          in_data['p'],
+                          out_data['Sn_S1'],
+                          in_data['L_dn'],
+                          in_data['emis_S'],
+                          out_data['z_0M'],
+                          out_data['d_0'],
+                          in_data['z_u'],
+                          in_data['z_T'],
+                          calcG_params=model_params["calcG_params"],
+                          mask=i,
+                          out=[out_data[field] for field in
+                               ['flag', 'Ln_S1', 'LE_S1', 'H_S1', 'G1', 'R_A1',
+                                'u_friction', 'L', 'n_iterations']])
+
+    def _open_raster(self, path):
+        '''Open a raster file for reading.
+
+        Rasters opened while processing an image are kept open, so that each input file is
+        opened only once even if it is read block by block. Paths that cannot be opened are also
+        remembered, so they are not probed again for every block. Compressed rasters are decoded
+        with multiple threads (see GDAL_OPEN_OPTIONS).
+
+        Parameters
+        ----------
+        path : string
+            Path to the raster file.
+
+        Returns
+        -------
+        fid : GDAL dataset or None
+            The opened raster, None if it could not be opened.
+        '''
+
+        if path not in self._rasters:
+            self._rasters[path] = gdal.OpenEx(path, gdal.OF_RASTER | gdal.OF_READONLY,
+                                              open_options=GDAL_OPEN_OPTIONS)
+        return self._rasters[path]
+
+    def _set_param_array(self, parameter, dims, band=1, out=None, window=None):
         '''Set model input parameter as an array.
 
         Parameters
@@ -785,6 +1312,12 @@ class PyTSEB(object):
         band : int (default = 1)
             Band (in GDAL convention) of raster file to be read, if parameter is to be read from a
             raster file.
+        out : float32 array, optional
+            Array with the given dimensions in which the parameter is set. A new array is
+            allocated if None.
+        window : int list, optional
+            Offset and size (xoff, yoff, xsize, ysize) of the window to read, if parameter is to
+            be read from a raster file. The whole raster is read if None.
 
         Returns
         -------
@@ -797,32 +1330,35 @@ class PyTSEB(object):
         success = True
         array = None
 
-        # See if the parameter is a number
+        # See if the parameter is a number. Otherwise see if the parameter is a parameter name and
+        # if it is then get the value of that parameter. The values are parsed before the array
+        # is allocated, so nothing is allocated for parameters which are not set
         try:
-            array = np.zeros(dims, np.float32) + float(parameter)
-            return success, array
-        except ValueError:
-            pass
-
-        # Otherwise see if the parameter is a parameter name
-        try:
-            inputString = self.p[parameter]
-        except KeyError:
-            success = False
-            return success, array
-        # If it is then get the value of that parameter
-        try:
-            array = np.zeros(dims, np.float32) + float(inputString)
-        except ValueError:
+            value = float(parameter)
+        except (TypeError, ValueError):
             try:
-                fid = gdal.Open(inputString, gdal.GA_ReadOnly)
-                if self.subset:
-                    array = fid.GetRasterBand(band).ReadAsArray(self.subset[0],
-                                                                self.subset[1],
-                                                                self.subset[2],
-                                                                self.subset[3]).astype(np.float32)
+                inputString = self.p[parameter]
+            except KeyError:
+                success = False
+                return success, array
+            try:
+                value = float(inputString)
+            except (TypeError, ValueError):
+                value = None
+
+        if out is None:
+            out = np.empty(dims, np.float32)
+        if value is not None:
+            out[...] = value
+            array = out
+        else:
+            try:
+                # GDAL converts the raster values to float32 while reading them into out
+                fid = self._open_raster(inputString)
+                if window:
+                    array = fid.GetRasterBand(band).ReadAsArray(*window, buf_obj=out)
                 else:
-                    array = fid.GetRasterBand(band).ReadAsArray().astype(np.float32)
+                    array = fid.GetRasterBand(band).ReadAsArray(buf_obj=out)
             except AttributeError:
                 print("%s image not present for parameter %s" % (inputString, parameter))
                 success = False
@@ -851,51 +1387,142 @@ class PyTSEB(object):
         None
         '''
 
-        # If the output file has .nc extension then save it as netCDF,
+        ds = self._create_raster_output(outfile, np.shape(output['H1']), fields)
+        self._write_raster_block(ds, output, fields, 0, 0)
+        self._close_raster_output(ds, outfile, fields)
+
+    def _create_raster_output(self, outfile, dims, fields):
+        '''Create a temporary tiled GeoTIFF, next to the output file, which will hold the output
+        fields until they are saved. netCDF outputs are instead created and written directly.
+
+        Parameters
+        ----------
+        outfile : string
+            Path to the output raster, see :meth:`write_raster_output`.
+        dims : int list
+            The dimensions of the output image.
+        fields : string list
+            The list of output fields, one per band.
+
+        Returns
+        -------
+        ds : GDAL dataset or netCDF4 Dataset
+            The temporary raster, or the output netCDF file itself if the outputs are saved as
+            netCDF.
+        '''
+
+        if OUTPUT_DRIVERS.get(splitext(outfile)[1].lower(), ("COG",))[0] == "netCDF":
+            return _create_netcdf(outfile, dims, fields, self.geo, self.prj)
+        rows, cols = dims
+        driver = gdal.GetDriverByName("GTiff")
+        ds = driver.Create(splitext(outfile)[0] + "_tmp.tif", cols, rows, len(fields),
+                           gdal.GDT_Float32, options=OUTPUT_CREATION_OPTIONS)
+        ds.SetGeoTransform(self.geo)
+        ds.SetProjection(self.prj)
+        for i in range(len(fields)):
+            ds.GetRasterBand(i + 1).SetNoDataValue(np.NaN)
+        return ds
+
+    def _write_output_blocks(self, out_ds, outputs, output, xoff, yoff):
+        '''Write a block of the outputs into the primary and ancillary output rasters.
+
+        Parameters
+        ----------
+        out_ds : list of GDAL datasets
+            The output rasters, see :meth:`_create_raster_output`.
+        outputs : list of (string, string list) tuples
+            The output files and their fields, see :meth:`_get_output_files`.
+        output : dict
+            The dictionary containing the output data arrays of the block.
+        xoff, yoff : int
+            Offset of the block within the output rasters.
+
+        Returns
+        -------
+        None
+        '''
+
+        for ds, (_, fields) in zip(out_ds, outputs):
+            self._write_raster_block(ds, output, fields, xoff, yoff)
+
+    def _write_raster_block(self, ds, output, fields, xoff, yoff):
+        '''Write a block of the output fields into a raster created by
+        :meth:`_create_raster_output`.
+
+        Parameters
+        ----------
+        ds : GDAL dataset or netCDF4 Dataset
+            The output raster.
+        output : dict
+            The dictionary containing the output data arrays of the block.
+        fields : string list
+            The list of output fields from the output dictionary to write.
+        xoff, yoff : int
+            Offset of the block within the output raster.
+
+        Returns
+        -------
+        None
+        '''
+
+        stack = np.stack([output[field] for field in fields]).astype(np.float32, copy=False)
+        for x, y, cols, rows in _valid_windows(stack):
+            data = stack[:, y:y + rows, x:x + cols]
+            if isinstance(ds, Dataset):
+                for field, values in zip(fields, data):
+                    ds[field][yoff + y:yoff + y + rows, xoff + x:xoff + x + cols] = values
+            else:
+                # All the bands are written with a single call, from a band interleaved float32
+                # buffer
+                ds.WriteRaster(xoff + x, yoff + y, cols, rows, np.ascontiguousarray(data),
+                               buf_xsize=cols, buf_ysize=rows, buf_type=gdal.GDT_Float32,
+                               band_list=list(range(1, len(fields) + 1)))
+
+    def _close_raster_output(self, ds, outfile, fields):
+        '''Save a raster created by :meth:`_create_raster_output` to file.
+
+        Parameters
+        ----------
+        ds : GDAL dataset or netCDF4 Dataset
+            The output raster.
+        outfile : string
+            Path to the output raster, see :meth:`write_raster_output`.
+        fields : string list
+            The list of output fields, one per band.
+
+        Returns
+        -------
+        None
+        '''
+
+        # netCDF outputs are already written in place
+        if isinstance(ds, Dataset):
+            ds.close()
+            return
+
+        # If the output file has .vrt extension then save one file per field,
         # otherwise assume that the output should be a GeoTIFF
-        ext = splitext(outfile)[1]
-        if ext.lower() == ".nc":
-            driver_name = "netCDF"
-            opt = ["FORMAT=NC4"]
-            opt = []
-        elif ext.lower() == ".vrt":
-            driver_name = "VRT"
-            opt = []
-        else:
-            driver_name = "COG"
-            opt = ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BIGTIFF=IF_SAFER']
-        if driver_name in ["COG", "netCDF"]:
-            # Save the data using GDAL by first creating a MEM layer and later using Translate
-            rows, cols = np.shape(output['H1'])
-            driver = gdal.GetDriverByName("MEM")
-            nbands = len(fields)
-            ds = driver.Create("MEM", cols, rows, nbands, gdal.GDT_Float32)
-            ds.SetGeoTransform(self.geo)
-            ds.SetProjection(self.prj)
+        driver_name, opt = OUTPUT_DRIVERS.get(splitext(outfile)[1].lower(),
+                                              ("COG", COG_CREATION_OPTIONS))
+        tmp_file = ds.GetDescription()
+        tmp_driver = gdal.GetDriverByName("GTiff")
+        if driver_name == "COG":
+            # Save the data using GDAL with Translate from the temporary GeoTIFF
             for i, field in enumerate(fields):
                 band = ds.GetRasterBand(i + 1)
-                band.WriteArray(output[field])
                 band.SetStatistics(*band.ComputeStatistics(0))
+            band = None
             out_ds = gdal.Translate(outfile, ds, format=driver_name, creationOptions=opt,
                                     noData=None)
             # If GDAL drivers for other formats do not exist then default to GeoTiff
             if out_ds is None:
                 print("Warning: Selected GDAL driver is not supported! Saving as GeoTiff!")
                 driver_name = "GTiff"
-                opt = ['COMPRESS=DEFLATE', 'PREDICTOR=1', 'BIGTIFF=IF_SAFER']
+                opt = GTIFF_CREATION_OPTIONS
                 gdal.Translate(outfile, ds, format=driver_name, creationOptions=opt, noData=None)
             out_ds = None
             ds = None
-            # In case of netCDF format use netCDF4 module to assign proper names
-            # to variables (GDAL can't do this). Also it seems that GDAL has
-            # problems assigning projection to all the bands so fix that.
-            if driver_name == "netCDF":
-                ds = Dataset(outfile, 'a')
-                grid_mapping = ds["Band1"].grid_mapping
-                for i, field in enumerate(fields):
-                    ds.renameVariable('Band{}'.format(i + 1), field)
-                    ds[field].grid_mapping = grid_mapping
-                ds.close()
+            tmp_driver.Delete(tmp_file)
 
         else:
             # Save each individual oputput in a GeoTIFF file in .data directory using GDAL
@@ -903,33 +1530,45 @@ class PyTSEB(object):
                            splitext(basename(outfile))[0] + ".data")
             if not exists(out_dir):
                 mkdir(out_dir)
-            out_files = []
-            rows, cols = np.shape(output['H1'])
             outfile_tif = (splitext(basename(outfile))[0]).replace("_ancillary", "")
-            for i, field in enumerate(fields):
-                driver = gdal.GetDriverByName("MEM")
-                out_path = join(out_dir, f"{outfile_tif}_{field}.tif")
-                ds = driver.Create("MEM", cols, rows, 1, gdal.GDT_Float32)
-                ds.SetGeoTransform(self.geo)
-                ds.SetProjection(self.prj)
-                band = ds.GetRasterBand(1)
-                band.WriteArray(output[field])
-                opt = ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BIGTIFF=IF_SAFER']
-                out_ds = gdal.Translate(out_path, ds, format="COG", creationOptions=opt,
-                                        noData=None, stats=True)
-                # If GDAL drivers for other formats do not exist then default to GeoTiff
-                if out_ds is None:
-                    opt = ['COMPRESS=DEFLATE', 'PREDICTOR=1', 'BIGTIFF=IF_SAFER']
-                    gdal.Translate(out_path, ds, format="GTiff", creationOptions=opt, noData=None,
-                                   stats=True)
-                out_ds = None
-                ds = None
-                out_files.extend([out_path])
+            out_files = [join(out_dir, f"{outfile_tif}_{field}.tif") for field in fields]
+            # Each output file is independent, so they are saved in parallel threads. GDAL
+            # datasets cannot be shared among threads, so each of them opens the temporary file
+            ds.FlushCache()
+            with ThreadPoolExecutor(max(min(len(fields), cpu_count() or 1), 1)) as executor:
+                list(executor.map(_save_band, [tmp_file] * len(fields),
+                                  range(1, len(fields) + 1), out_files))
 
             # Create the Virtual Raster Table
             out_vrt = out_dir.replace('.data', '.vrt')
             print(out_files)
-            gdal.BuildVRT(out_vrt, out_files, separate=True)
+            _build_vrt(out_vrt, out_files, fields, ds)
+            ds = None
+            tmp_driver.Delete(tmp_file)
+
+    def _discard_raster_output(self, ds):
+        '''Close a raster created by :meth:`_create_raster_output` without saving it. The
+        temporary GeoTIFF is deleted, while netCDF outputs are closed with the blocks already
+        written.
+
+        Parameters
+        ----------
+        ds : GDAL dataset or netCDF4 Dataset
+            The output raster.
+
+        Returns
+        -------
+        None
+        '''
+
+        if isinstance(ds, Dataset):
+            if ds.isopen():
+                ds.close()
+            return
+        tmp_file = ds.GetDescription()
+        ds = None
+        if exists(tmp_file):
+            gdal.GetDriverByName("GTiff").Delete(tmp_file)
 
     def _get_output_structure(self):
         ''' Output fields' names for TSEB model.
@@ -942,53 +1581,11 @@ class PyTSEB(object):
         -------
         output_structure: ordered dict
             Names of the output fields as keys and instructions on whether the output
-            should be saved to file as values.
+            should be saved to file as values. A copy of TSEB_OUTPUT_STRUCTURE, plus the
+            optional outputs.
         '''
 
-        output_structure = OrderedDict([
-            # Energy fluxes
-            ('R_n1', S_P),   # net radiation reaching the surface at time t1
-            ('R_ns1', S_A),  # net shortwave radiation reaching the surface at time t1
-            ('R_nl1', S_A),  # net longwave radiation reaching the surface at time t1
-            ('delta_R_n1', S_A),  # net radiation divergence in the canopy at time t1
-            ('Sn_S1', S_N),  # Shortwave radiation reaching the soil at time t1
-            ('Sn_C1', S_N),  # Shortwave radiation intercepted by the canopy at time t1
-            ('Ln_S1', S_N),  # Longwave radiation reaching the soil at time t1
-            ('Ln_C1', S_N),  # Longwave radiation intercepted by the canopy at time t1
-            ('H_C1', S_A),  # canopy sensible heat flux (W/m^2) at time t1
-            ('H_S1', S_N),  # soil sensible heat flux (W/m^2) at time t1
-            ('H1', S_P),  # total sensible heat flux (W/m^2) at time t1
-            ('LE_C1', S_A),  # canopy latent heat flux (W/m^2) at time t1
-            ('LE_S1', S_N),  # soil latent heat flux (W/m^2) at time t1
-            ('LE1', S_P),  # total latent heat flux (W/m^2) at time t1
-            ('LE_partition', S_A),  # Latent Heat Flux Partition (LEc/LE) at time t1
-            ('G1', S_P),  # ground heat flux (W/m^2) at time t1
-            # temperatures (might not be accurate)
-            ('T_C1', S_A),  # canopy temperature at time t1 (deg C)
-            ('T_S1', S_A),  # soil temperature at time t1 (deg C)
-            ('T_AC1', S_N),  # air temperature at the canopy interface at time t1 (deg C)
-            # resistances
-            # resistance to heat transport in the surface layer (s/m) at time t1
-            ('R_A1', S_A),
-            # resistance to heat transport in the canopy surface layer (s/m) at time t1
-            ('R_x1', S_A),
-            # resistance to heat transport from the soil surface (s/m) at time t1 fluxes
-            ('R_S1', S_A),
-            # miscaleneous
-            ('albedo1', S_N),    # surface albedo (Rs_out/Rs_in)
-            ('omega0', S_N),  # nadir view vegetation clumping factor
-            ('alpha', S_N),  # the priestly Taylor factor
-            ('Ri', S_N),  # Richardson number at time t1
-            ('L', S_A),  # Monin Obukhov Length at time t1
-            ('u_friction', S_A),  # Friction velocity
-            ('theta_s1', S_N),  # Sun zenith angle at time t1
-            ('F', S_N),  # Leaf Area Index
-            ('z_0M', S_N),  # Aerodynamic roughness length for momentum trasport (m)
-            ('d_0', S_N),  # Zero-plane displacement height (m)
-            ('Skyl', S_N),
-            ('flag', S_A),  # Quality flag
-            ('n_iterations', S_N)])  # Number of iterations before model converged to stable value
-
+        output_structure = OrderedDict(TSEB_OUTPUT_STRUCTURE)
 
         if self.calc_daily_ET:
             output_structure['ET_day'] = S_P
@@ -1010,63 +1607,13 @@ class PyTSEB(object):
         Returns
         -------
         input_fields: string ordered dict
-            Names (keys) and descriptions (values) of TSEB_PT input fields.
+            Names (keys) and descriptions (values) of TSEB_PT input fields. A copy of
+            TSEB_INPUT_STRUCTURE, which models can modify.
         '''
 
-        input_fields = OrderedDict([
-                            # General parameters
-                            ("T_R1", "Land Surface Temperature"),
-                            ("LAI", "Leaf Area Index"),
-                            ("VZA", "View Zenith Angle for LST"),
-                            ("landcover", "Landcover"),
-                            ("input_mask", "Input Mask"),
-                            # Vegetation parameters
-                            ("f_c", "Fractional Cover"),
-                            ("h_C", "Canopy Height"),
-                            ("w_C", "Canopy Width Ratio"),
-                            ("f_g", "Green Vegetation Fraction"),
-                            ("leaf_width", "Leaf Width"),
-                            ("x_LAD", "Leaf Angle Distribution"),
-                            ("alpha_PT", "Initial Priestley-Taylor Alpha Value"),
-                            # Spectral Properties
-                            ("rho_vis_C", "Leaf PAR Reflectance"),
-                            ("tau_vis_C", "Leaf PAR Transmitance"),
-                            ("rho_nir_C", "Leaf NIR Reflectance"),
-                            ("tau_nir_C", "Leaf NIR Transmitance"),
-                            ("rho_vis_S", "Soil PAR Reflectance"),
-                            ("rho_nir_S", "Soil NIR Reflectance"),
-                            ("emis_C", "Leaf Emissivity"),
-                            ("emis_S", "Soil Emissivity"),
-                            # Illumination conditions
-                            ("lat", "Latitude"),
-                            ("lon", "Longitude"),
-                            ("stdlon", "Standard Longitude"),
-                            ("time", "Observation Time for LST"),
-                            ("DOY", "Observation Day Of Year for LST"),
-                            ("SZA", "Sun Zenith Angle"),
-                            ("SAA", "Sun Azimuth Angle"),
-                            # Meteorological parameters
-                            ("T_A1", "Air temperature"),
-                            ("u", "Wind Speed"),
-                            ("ea", "Vapour Pressure"),
-                            ("alt", "Altitude"),
-                            ("p", "Pressure"),
-                            ("S_dn", "Shortwave Irradiance"),
-                            ("z_T", "Air Temperature Height"),
-                            ("z_u", "Wind Speed Height"),
-                            ("z0_soil", "Soil Roughness"),
-                            ("L_dn", "Longwave Irradiance"),
-                            # Resistance parameters
-                            ("KN_b", "Kustas and Norman Resistance Parameter b"),
-                            ("KN_c", "Kustas and Norman Resistance Parameter c"),
-                            ("KN_C_dash", "Kustas and Norman Resistance Parameter c-dash"),
-                            # Soil heat flux parameter
-                            ("G", "Soil Heat Flux Parameter"),
-                            ('S_dn_24', 'Daily shortwave irradiance')])
+        return OrderedDict(TSEB_INPUT_STRUCTURE)
 
-        return input_fields
-
-    def _set_special_model_input(self, field, dims):
+    def _set_special_model_input(self, field, dims, window=None):
         ''' Special processing for setting certain input fields. Only relevant for image processing
         mode.
 
@@ -1076,6 +1623,9 @@ class PyTSEB(object):
             The name of the input field for which the special processing is needed.
         dims : int list
             The dimensions of the output parameter array.
+        window : int list, optional
+            Offset and size (xoff, yoff, xsize, ysize) of the window to read from the raster
+            files. The whole rasters are read if None.
 
         Returns
         -------
@@ -1096,22 +1646,27 @@ class PyTSEB(object):
 
         Returns
         -------
-        required_columns : string tuple
+        required_columns : frozenset
             Names of the required input columns.
         '''
 
-        required_columns = ('year',
-                            'DOY',
-                            'time',
-                            'T_R1',
-                            'VZA',
-                            'T_A1',
-                            'u',
-                            'ea',
-                            'S_dn',
-                            'LAI',
-                            'h_C')
-        return required_columns
+        return TSEB_REQUIRED_COLUMNS
+
+    def _get_temperature_fields(self):
+        ''' Names of the radiometric temperature inputs of the TSEB_PT model. Fluxes are not
+        calculated for the pixels or points where any of them is not finite.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        temperature_fields : string tuple
+            Names of the temperature input fields.
+        '''
+
+        return ('T_R1',)
 
     def _get_subset(self, roi_shape, raster_proj_wkt, raster_geo_transform):
 
@@ -1203,25 +1758,27 @@ class PyDTD(PyTSEB):
 
         Returns
         -------
-        required_columns : string tuple
+        required_columns : frozenset
             Names of the required input columns.
         '''
 
-        required_columns = ('year',
-                            'DOY',
-                            'time',
-                            'T_R0',
-                            'T_R1',
-                            'VZA',
-                            'T_A0',
-                            'T_A1',
-                            'u',
-                            'ea',
-                            'S_dn',
-                            'LAI',
-                            'h_C')
-
-        return required_columns
+        return DTD_REQUIRED_COLUMNS
+
+    def _get_temperature_fields(self):
+        ''' Names of the radiometric temperature inputs of the DTD model. Fluxes are not
+        calculated for the pixels or points where any of them is not finite.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        temperature_fields : string tuple
+            Names of the temperature input fields.
+        '''
+
+        return ('T_R0', 'T_R1')
 
     def _call_flux_model_veg(self, in_data, out_data, model_params, i):
         ''' Call a DTD model to calculate fluxes for data points containing vegetation.
@@ -1240,6 +1797,7 @@ class PyDTD(PyTSEB):
         None
         '''
 
+        params = _subset_model_params(model_params, i)
         [out_data['flag'][i], out_data['T_S1'][i], out_data['T_C1'][i],
             out_data['T_AC1'][i], out_data['Ln_S1'][i], out_data['Ln_C1'][i],
             out_data['LE_C1'][i], out_data['H_C1'][i], out_data['LE_S1'][i],
@@ -1272,11 +1830,8 @@ class PyDTD(PyTSEB):
                 z0_soil=in_data['z0_soil'][i],
                 alpha_PT=in_data['alpha_PT'][i],
                 x_LAD=in_data['x_LAD'][i],
-                calcG_params=[model_params["calcG_params"][0],
-                              model_params["calcG_params"][1][i]],
-                resistance_form=[model_params["resistance_form"][0],
-                                 {k: model_params["resistance_form"][1][k][i]
-                                  for k in model_params["resistance_form"][1]}])
+                calcG_params=params["calcG_params"],
+                resistance_form=params["resistance_form"])
 
     def _call_flux_model_soil(self, in_data, out_data, model_params, i):
         ''' Call a OSEB model to calculate soil fluxes for data points containing no vegetation.
@@ -1295,29 +1850,24 @@ class PyDTD(PyTSEB):
         None
         '''
 
-        [out_data['flag'][i],
-         out_data['Ln_S1'][i],
-         out_data['LE_S1'][i],
-         out_data['H_S1'][i],
-         out_data['G1'][i],
-         out_data['R_A1'][i],
-         out_data['u_friction'][i],
-         out_data['L'][i],
-         out_data['n_iterations'][i]] = TSEB.OSEB(in_data['T_R1'][i],
-                                                  in_data['T_A1'][i],
-                                                  in_data['u'][i],
-                                                  in_data['ea'][i],
-                                                  in_data['p'][i],
-                                                  out_data['Sn_S1'][i],
-                                                  in_data['L_dn'][i],
-                                                  in_data['emis_S'][i],
-                                                  out_data['z_0M'][i],
-                                                  out_data['d_0'][i],
-                                                  in_data['z_u'][i],
-                                                  in_data['z_T'][i],
-                                                  calcG_params=[model_params["calcG_params"][0],
-                                                                model_params["calcG_params"][1][i]],
-                                                  T0_K=(in_data['T_R0'][i], in_data['T_A0'][i]))
+        _tseb_kernel.OSEB(in_data['T_R1'],
+                          in_data['T_A1'],
+                          in_data['u'],
+                          in_data['ea'],
+                          in_data['p'],
+                          out_data['Sn_S1'],
+                          in_data['L_dn'],
+                          in_data['emis_S'],
+                          out_data['z_0M'],
+                          out_data['d_0'],
+                          in_data['z_u'],
+                          in_data['z_T'],
+                          calcG_params=model_params["calcG_params"],
+                          T0_K=(in_data['T_R0'], in_data['T_A0']),
+                          mask=i,
+                          out=[out_data[field] for field in
+                               ['flag', 'Ln_S1', 'LE_S1', 'H_S1', 'G1', 'R_A1',
+                                'u_friction', 'L', 'n_iterations']])
 
 
 class PyTSEB2T(PyTSEB):
@@ -1344,7 +1894,7 @@ class PyTSEB2T(PyTSEB):
         input_fields["T_S"] = "Soil Temperature"
         return input_fields
 
-    def _set_special_model_input(self, field, dims):
+    def _set_special_model_input(self, field, dims, window=None):
         ''' Special processing for setting certain input fields. Only relevant for image processing
         mode.
 
@@ -1354,6 +1904,9 @@ class PyTSEB2T(PyTSEB):
             The name of the input field for which the special processing is needed.
         dims : int list
             The dimensions of the output parameter array.
+        window : int list, optional
+            Offset and size (xoff, yoff, xsize, ysize) of the window to read from the raster
+            files. The whole rasters are read if None.
 
         Returns
         -------
@@ -1364,10 +1917,10 @@ class PyTSEB2T(PyTSEB):
         '''
 
         if field == "T_C":
-            success, val = self._set_param_array("T_R1", dims)
+            success, val = self._set_param_array("T_R1", dims, window=window)
             inputs = {field: val}
         elif field == "T_S":
-            success, val = self._set_param_array("T_R1", dims, band=2)
+            success, val = self._set_param_array("T_R1", dims, band=2, window=window)
             inputs = {field: val}
         else:
             success = False
@@ -1384,22 +1937,27 @@ class PyTSEB2T(PyTSEB):
 
         Returns
         -------
-        required_columns : string tuple
+        required_columns : frozenset
             Names of the required input columns.
         '''
 
-        required_columns = ('year',
-                            'DOY',
-                            'time',
-                            'T_C',
-                            'T_S',
-                            'T_A1',
-                            'u',
-                            'ea',
-                            'S_dn',
-                            'LAI',
-                            'h_C')
-        return required_columns
+        return TSEB_2T_REQUIRED_COLUMNS
+
+    def _get_temperature_fields(self):
+        ''' Names of the radiometric temperature inputs of the TSEB_2T model. Fluxes are not
+        calculated for the pixels or points where any of them is not finite.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        temperature_fields : string tuple
+            Names of the temperature input fields.
+        '''
+
+        return ('T_C', 'T_S')
 
     def _call_flux_model_veg(self, in_data, out_data, model_params, i):
         ''' Call a TSEB_2T model to calculate fluxes for data points containing vegetation.
@@ -1418,6 +1976,7 @@ class PyTSEB2T(PyTSEB):
         None
         '''
 
+        params = _subset_model_params(model_params, i)
         [out_data['flag'][i], out_data['T_AC1'][i], out_data['Ln_S1'][i],
          out_data['Ln_C1'][i], out_data['LE_C1'][i], out_data['H_C1'][i],
          out_data['LE_S1'][i], out_data['H_S1'][i], out_data['G1'][i],
@@ -1447,11 +2006,8 @@ class PyTSEB2T(PyTSEB):
              z0_soil=in_data['z0_soil'][i],
              alpha_PT=in_data['alpha_PT'][i],
              x_LAD=in_data['x_LAD'][i],
-             calcG_params=[model_params["calcG_params"][0],
-                           model_params["calcG_params"][1][i]],
-             resistance_form=[model_params["resistance_form"][0],
-                              {k: model_params["resistance_form"][1][k][i]
-                              for k in model_params["resistance_form"][1]}])
+             calcG_params=params["calcG_params"],
+             resistance_form=params["resistance_form"])
 
     def _call_flux_model_soil(self, in_data, out_data, model_params, i):
         ''' Call a OSEB model to calculate soil fluxes for data points containing no vegetation.
@@ -1470,32 +2026,30 @@ class PyTSEB2T(PyTSEB):
         None
         '''
 
-        [out_data['flag'][i],
-         out_data['Ln_S1'][i],
-         out_data['LE_S1'][i],
-         out_data['H_S1'][i],
-         out_data['G1'][i],
-         out_data['R_A1'][i],
-         out_data['u_friction'][i],
-         out_data['L'][i],
-         out_data['n_iterations'][i]] = TSEB.OSEB(in_data['T_S'][i],
-                                                  in_data['T_A1'][i],
-                                                  in_data['u'][i],
-                                                  in_data['ea'][i],
-                                                  in_data['p'][i],
-                                                  out_data['Sn_S1'][i],
-                                                  in_data['L_dn'][i],
-                                                  in_data['emis_S'][i],
-                                                  out_data['z_0M'][i],
-                                                  out_data['d_0'][i],
-                                                  in_data['z_u'][i],
-                                                  in_data['z_T'][i],
-                                                  calcG_params=[model_params["calcG_params"][0],
-                                                                model_params["calcG_params"][1][i]])
+        _tseb_kernel.OSEB(in_data['T_S'],
+                          in_data['T_A1'],
+                          in_data['u'],
+                          in_data['ea'],
+                          in_data['p'],
+                          out_data['Sn_S1'],
+                          in_data['L_dn'],
+                          in_data['emis_S'],
+                          out_data['z_0M'],
+                          out_data['d_0'],
+                          in_data['z_u'],
+                          in_data['z_T'],
+                          calcG_params=model_params["calcG_params"],
+                          mask=i,
+                          out=[out_data[field] for field in
+                               ['flag', 'Ln_S1', 'LE_S1', 'H_S1', 'G1', 'R_A1',
+                                'u_friction', 'L', 'n_iterations']])
 
 
 class PydisTSEB(PyTSEB):
 
+    # dis_TSEB disaggregates the fluxes of the whole image in a single call of the vegetation model
+    SOLVES_WHOLE_IMAGE = True
+
     def __init__(self, parameters):
 
         super().__init__(parameters)
@@ -1542,7 +2096,7 @@ class PydisTSEB(PyTSEB):
         output_structure["counter"] = S_A
         return output_structure
 
-    def _set_special_model_input(self, field, dims):
+    def _set_special_model_input(self, field, dims, window=None):
         ''' Special processing for setting certain input fields. Only relevant for image processing
         mode.
 
@@ -1552,6 +2106,9 @@ class PydisTSEB(PyTSEB):
             The name of the input field for which the special processing is needed.
         dims : int list
             The dimensions of the output parameter array.
+        window : int list, optional
+            Offset and size (xoff, yoff, xsize, ysize) of the window to read from the raster
+            files. The whole rasters are read if None.
 
         Returns
         -------
@@ -1563,7 +2120,7 @@ class PydisTSEB(PyTSEB):
         if field in ["flux_LR", "flux_LR_ancillary"]:
             # Low resolution data in case disaggregation is to be used.
             inputs = {}
-            fid = gdal.Open(self.p[field], gdal.GA_ReadOnly)
+            fid = self._open_raster(self.p[field])
             if fid is None:
                 print("ERROR: Low resolution data for disaggregation is not avaiable.")
                 return False, None
@@ -1575,9 +2132,10 @@ class PydisTSEB(PyTSEB):
                 inputs[field] = fid.GetRasterBand(1).ReadAsArray(subset[0],
                                                                  subset[1],
                                                                  subset[2],
-                                                                 subset[3]).astype(np.float32)
+                                                                 subset[3])
             else:
-                inputs[field] = fid.GetRasterBand(1).ReadAsArray().astype(np.float32)
+                inputs[field] = fid.GetRasterBand(1).ReadAsArray()
+            inputs[field] = inputs[field].astype(np.float32, copy=False)
             inputs['scale'] = [geo_LR, prj_LR, self.geo, self.prj]
             success = True
         else:
@@ -1586,6 +2144,11 @@ class PydisTSEB(PyTSEB):
 
         return success, inputs
 
+    def _iter_blocks(self, fid, dims):
+        ''' The disaggregation of the low resolution fluxes needs the whole image, so it is
+        processed as a single block.'''
+        yield 0, 0, dims[1], dims[0]
+
     def _call_flux_model_soil(self, in_data, out_data, model_params, i):
         return
 
@@ -1608,6 +2171,9 @@ class PydisTSEB(PyTSEB):
 
         print('Running dis TSEB for the whole image')
 
+        # dis_TSEB returns the flags of the whole image, the pixels flagged as invalid by
+        # :meth:`run` keep their flag
+        invalid = out_data['flag'] == TSEB.F_INVALID
         [out_data['flag'],
          out_data['T_S1'],
          out_data['T_C1'],
@@ -1659,3 +2225,4 @@ class PydisTSEB(PyTSEB):
              resistance_form=model_params["resistance_form"],
              flux_LR_method=self.flux_LR_method,
              correct_LST=self.correct_LST)
+        out_data['flag'][invalid] = TSEB.F_INVALID
@@ -318,7 +318,7 @@ def TSEB_2T(T_C,
     # calcG_params[1] = None
     # Create the output variables
     [flag, Ln_S, Ln_C, LE_C, H_C, LE_S, H_S, G, R_S, R_x,
-        R_A, iterations] = [np.zeros(T_S.shape, np.float32)+np.NaN for i in range(12)]
+        R_A, iterations] = [np.full(T_S.shape, np.NaN, np.float32) for i in range(12)]
     T_AC = T_A_K.copy()
 
     # iteration of the Monin-Obukhov length
@@ -670,15 +670,15 @@ def TSEB_PT(Tr_K,
     # calcG_params[1] = None
     # Create the output variables
     [Ln_S, Ln_C, H, LE, LE_C, H_C, LE_S, H_S, G, R_S, R_x, R_A, delta_Rn,
-     Rn_S, iterations] = [np.zeros(Tr_K.shape, np.float32)+np.NaN for i in range(15)]
+     Rn_S, iterations] = [np.full(Tr_K.shape, np.NaN, np.float32) for i in range(15)]
 
     # iteration of the Monin-Obukhov length
     if const_L is None:
         # Initially assume stable atmospheric conditions and set variables for
-        L = np.zeros(Tr_K.shape) + np.inf
+        L = np.full(Tr_K.shape, np.inf, np.float32)
         max_iterations = ITERATIONS
     else:  # We force Monin-Obukhov lenght to the provided array/value
-        L = np.ones(Tr_K.shape) * const_L
+        L = np.asarray(np.ones(Tr_K.shape) * const_L, dtype=np.float32)
         max_iterations = 1  # No iteration
     # Calculate the general parameters
     rho = met.calc_rho(p, ea, T_A_K)  # Air density
@@ -1133,7 +1133,7 @@ def DTD(Tr_K_0,
     resistance_form = resistance_form[0]
     # Create the output variables
     [flag, T_S, T_C, T_AC, Ln_S, Ln_C, LE_C, H_C, LE_S, H_S, G, R_S, R_x,
-        R_A, H, iterations] = [np.zeros(Tr_K_1.shape, np.float32) + np.NaN for i in range(16)]
+        R_A, H, iterations] = [np.full(Tr_K_1.shape, np.NaN, np.float32) for i in range(16)]
 
     # Calculate the general parameters
     rho = met.calc_rho(p, ea, T_A_K_1)  # Air density
@@ -1478,15 +1478,15 @@ def OSEB(Tr_K,
                          calcG_params[1]],
                         [Tr_K] * 12)
     # Create the output variables
-    [flag, Ln, LE, H, G, R_A] = [np.zeros(Tr_K.shape, np.float32) + np.NaN for i in range(6)]
+    [flag, Ln, LE, H, G, R_A] = [np.full(Tr_K.shape, np.NaN, np.float32) for i in range(6)]
 
     # iteration of the Monin-Obukhov length
     if const_L is None:
         # Initially assume stable atmospheric conditions and set variables for
-        L = np.zeros(Tr_K.shape) + np.inf
+        L = np.full(Tr_K.shape, np.inf, np.float32)
         max_iterations = ITERATIONS
     else:  # We force Monin-Obukhov lenght to the provided array/value
-        L = np.ones(Tr_K.shape) * const_L
+        L = np.asarray(np.ones(Tr_K.shape) * const_L, dtype=np.float32)
         max_iterations = 1  # No iteration
 
     # Check if differential temperatures are to be used
@@ -1516,9 +1516,9 @@ def OSEB(Tr_K,
         u_friction = MO.calc_u_star(u, z_u, L_from_Ri, d_0, z_0M)
     else:
         u_friction = MO.calc_u_star(u, z_u, L, d_0, z_0M)
-    u_friction = np.maximum(U_FRICTION_MIN, u_friction)
-    L_old = np.ones(Tr_K.shape)
-    L_diff = np.ones(Tr_K.shape) * float('inf')
+    u_friction = np.asarray(np.maximum(U_FRICTION_MIN, u_friction), dtype=np.float32)
+    L_old = np.ones(Tr_K.shape, np.float32)
+    L_diff = np.full(Tr_K.shape, np.inf, np.float32)
 
     z_0H = res.calc_z_0H(z_0M, kB=kB)
 
@@ -1534,7 +1534,7 @@ def OSEB(Tr_K,
     # Stops when difference in consecutive L and u_friction is below a
     # given threshold
     for n_iterations in range(max_iterations):
-        flag = np.zeros(Tr_K.shape) + F_ALL_FLUXES_OS
+        flag = np.full(Tr_K.shape, F_ALL_FLUXES_OS, np.float32)
         # Stop the iteration if differences are below the threshold
         if np.all(L_diff < L_thres):
             break
@@ -2617,7 +2617,7 @@ def calc_resistances(res_form, res_types):
             # Vegetation in series with soil, i.e. well mixed, so we use
             # the landscape LAI
             R_x = res.calc_R_x_Choudhury(u_C, LAI, leaf_width, alpha_prime=alpha_prime)
-            del LAI, alpha_prime
+            del alpha_prime
 
         if calc_R_S:
             # Clumped vegetation enhanced wind speed for the soil surface
@@ -0,0 +1,783 @@
+# This file is part of pyTSEB for running different TSEB models
+# Copyright 2016 Hector Nieto and contributors listed in the README.md file.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+DESCRIPTION
+===========
+Per-pixel versions of the iterative TSEB solvers, compiled with `Numba <https://numba.pydata.org>`_
+when it is installed. Each pixel iterates the Monin-Obukhov stability until its own convergence
+inside a single compiled loop, and pixels are distributed among all the available cores.
+
+Numba is an optional dependency. If it is not installed, or if the environment variable
+``PYTSEB_DISABLE_NUMBA`` is set, the functions in this module fall back to the NumPy
+implementations in :doc:`TSEB`. The same happens for model configurations not covered by the
+compiled kernels.
+
+PACKAGE CONTENTS
+================
+* :func:`calc_diffuse_split` Direct and diffuse components of the shortwave irradiance.
+* :func:`OSEB` One Source Energy Balance Model.
+* :func:`TSEB_PT` Priestley-Taylor TSEB using a single observation of composite radiometric
+                  temperature.
+'''
+
+import os
+
+import numpy as np
+
+from . import TSEB
+from . import meteo_utils as met
+from . import resistances as res
+from . import MO_similarity as MO
+from . import net_radiation as rad
+from . import clumping_index as CI
+from . import wind_profile as wnd
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+USE_NUMBA = numba is not None and not os.environ.get("PYTSEB_DISABLE_NUMBA")
+# Resistance formulations implemented in the compiled TSEB_PT kernel
+RESISTANCE_FORMS = (TSEB.KUSTAS_NORMAN_1999,
+                    TSEB.CHOUDHURY_MONTEITH_1988,
+                    TSEB.MCNAUGHTON_VANDERHURK,
+                    TSEB.CHOUDHURY_MONTEITH_ALPHA_1988)
+
+if USE_NUMBA:
+    # Fast math flags that keep the handling of NaN and infinite values. The kernels release
+    # the GIL, so they can also run concurrently in threads
+    _FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+    _jit = numba.njit(cache=True, nogil=True, error_model="numpy", fastmath=_FASTMATH)
+    _parallel_jit = numba.njit(cache=True, nogil=True, parallel=True, error_model="numpy",
+                               fastmath=_FASTMATH)
+    _prange = numba.prange
+else:
+    def _jit(func):
+        return func
+    _parallel_jit = _jit
+    _prange = range
+
+
+def set_num_threads(n_threads):
+    '''Sets the number of threads used by the parallel kernels of this process. It has no
+    effect when Numba is not used.'''
+    if USE_NUMBA:
+        numba.set_num_threads(max(min(n_threads, numba.config.NUMBA_NUM_THREADS), 1))
+
+
+# ==============================================================================
+# Scalar versions of the MOST, resistance and energy balance routines
+# ==============================================================================
+@_jit
+def _psi_m(zol):
+    # See MO_similarity.psi_m_brutsaert
+    if not np.isfinite(zol):
+        return 0.0
+    if zol >= 0.0:
+        return -6.1 * np.log(zol + (1.0 + zol**2.5)**(1.0 / 2.5))
+    y = -zol
+    a = 0.33
+    b = 0.41
+    x = (y / a)**0.333333
+    psi_0 = -np.log(a) + 3**0.5 * b * a**0.333333 * np.pi / 6.0
+    y = min(y, b**-3)
+    return (np.log(a + y) - 3.0 * b * y**0.333333
+            + (b * a**0.333333) / 2.0 * np.log((1.0 + x)**2 / (1.0 - x + x**2))
+            + 3.0**0.5 * b * a**0.333333 * np.arctan((2.0 * x - 1.0) / 3**0.5)
+            + psi_0)
+
+
+@_jit
+def _psi_h(zol):
+    # See MO_similarity.psi_h_brutsaert
+    if not np.isfinite(zol):
+        return 0.0
+    if zol >= 0.0:
+        return -6.1 * np.log(zol + (1.0 + zol**2.5)**(1.0 / 2.5))
+    y = -zol
+    return ((1.0 - 0.057) / 0.78) * np.log((0.33 + y**0.78) / 0.33)
+
+
+@_jit
+def _u_star(u, z_u, L, d_0, z_0M):
+    # See MO_similarity.calc_u_star
+    if L == 0.0:
+        L = 1e-36
+    u_star = u * MO.KARMAN / (np.log((z_u - d_0) / z_0M)
+                              - _psi_m((z_u - d_0) / L) + _psi_m(z_0M / L))
+    return np.maximum(TSEB.U_FRICTION_MIN, u_star)
+
+
+@_jit
+def _mo_length(u_friction, T_A_K, rho, c_p, H, LE, Lambda):
+    # See MO_similarity.calc_mo_length_hv
+    Hv = H + 0.61 * T_A_K * c_p * LE / Lambda
+    if Hv == 0:
+        return np.inf
+    return -u_friction**3 / ((MO.KARMAN * MO.GRAVITY / T_A_K) * (Hv / (rho * c_p)))
+
+
+@_jit
+def _R_A(z_T, u_friction, L, d_0, z_0H):
+    # See resistances.calc_R_A
+    if L == 0.0:
+        L = 1e-36
+    if u_friction == 0:
+        return np.inf
+    R_A = ((np.log((z_T - d_0) / z_0H) - _psi_h((z_T - d_0) / L) + _psi_h(z_0H / L))
+           / (u_friction * MO.KARMAN))
+    return np.maximum(1e-3, R_A)
+
+
+@_jit
+def _R_S_Choudhury(u_friction, h_C, z_0M, d_0, z0_soil, alpha_k):
+    # See resistances.calc_R_S_Choudhury
+    K_h = res.KARMAN * u_friction * (h_C - d_0)
+    return ((h_C * np.exp(alpha_k) / (alpha_k * K_h))
+            * (np.exp(-alpha_k * z0_soil / h_C) - np.exp(-alpha_k * (d_0 + z_0M) / h_C)))
+
+
+@_jit
+def _R_x_R_S(res_form, u_friction, h_C, d_0, z_0M, L, LAI, leaf_width, z0_soil, a_goudriaan,
+             deltaT, KN_b, KN_c, KN_C_dash):
+    # See TSEB.calc_resistances, for all the formulations in RESISTANCE_FORMS
+    u_C = (u_friction * (np.log((h_C - d_0) / z_0M) - _psi_m((h_C - d_0) / L)
+                         + _psi_m(z_0M / L))) / wnd.KARMAN
+    if res_form == TSEB.CHOUDHURY_MONTEITH_1988:
+        R_x = 1.0 / (LAI * (2.0 * res.CM_a / 3.0) * np.sqrt(u_C / leaf_width)
+                     * (1.0 - np.exp(-3.0 / 2.0)))
+        R_S = _R_S_Choudhury(u_friction, h_C, z_0M, d_0, z0_soil, 2.0)
+    elif res_form == TSEB.MCNAUGHTON_VANDERHURK:
+        R_x = (130.0 / LAI) * np.sqrt(leaf_width * u_friction) + 0.36 / u_friction
+        R_S = 10.0 / u_friction
+    elif res_form == TSEB.CHOUDHURY_MONTEITH_ALPHA_1988:
+        R_x = 1.0 / (LAI * (2.0 * res.CM_a / a_goudriaan) * np.sqrt(u_C / leaf_width)
+                     * (1.0 - np.exp(-a_goudriaan / 2.0)))
+        R_S = _R_S_Choudhury(u_friction, h_C, z_0M, d_0, z0_soil, a_goudriaan)
+    else:
+        u_d_zm = u_C * np.exp(-a_goudriaan * (1.0 - ((d_0 + z_0M) / h_C)))
+        R_x = (KN_C_dash / LAI) * np.sqrt(leaf_width / u_d_zm)
+        u_S = np.maximum(u_C * np.exp(-a_goudriaan * (1.0 - (z0_soil / h_C))), TSEB.U_S_MIN)
+        R_S = 1.0 / (KN_c * np.maximum(deltaT, 0.0)**(1.0 / 3.0) + KN_b * u_S)
+    return np.maximum(1e-3, R_x), np.maximum(1e-3, R_S)
+
+
+@_jit
+def _calc_G(G_form, G_param, G_coef, Rn_S):
+    # See TSEB.calc_G, G_param holds the per-pixel parameter and G_coef the shared ones
+    if G_form == TSEB.G_CONSTANT:
+        return G_param
+    elif G_form == TSEB.G_RATIO:
+        return G_param * Rn_S
+    elif G_form == TSEB.G_TIME_DIFF:
+        return Rn_S * G_coef[0] * np.cos(2.0 * np.pi * (G_param - 12.0 + G_coef[1]) / G_coef[2])
+    elif G_form == TSEB.G_TIME_DIFF_SIGMOID:
+        return Rn_S * (G_coef[0] + (G_coef[1] - G_coef[0])
+                       * 0.5 * (np.tanh((G_param - G_coef[2]) / G_coef[4])
+                                - np.tanh((G_param - G_coef[3]) / G_coef[5])))
+    return np.nan
+
+
+@_jit
+def _calc_T_S(Tr_K, T_C, f_theta):
+    # See TSEB.calc_T_S
+    T_temp = Tr_K**4 - f_theta * T_C**4
+    if T_temp >= 0:
+        return TSEB.F_ALL_FLUXES, (T_temp / (1.0 - f_theta))**0.25
+    return TSEB.F_INVALID, 1e-6
+
+
+@_jit
+def _L_diff(L, L_old):
+    # See TSEB._L_diff
+    L_diff = np.float32(np.fabs(L - L_old) / np.fabs(L_old))
+    if np.isnan(L_diff):
+        return np.inf
+    return L_diff
+
+
+# ==============================================================================
+# Per-pixel solvers
+# ==============================================================================
+@_jit
+def _oseb_point(Tr_K, T_A_K, u, z_0M, d_0, z_u, z_T, rho, c_p, z_0H, Lambda, Rn, G,
+                max_iterations):
+
+    L = np.inf
+    L_old = 1.0
+    L_diff = np.inf
+    u_friction = _u_star(u, z_u, L, d_0, z_0M)
+    flag = TSEB.F_ALL_FLUXES_OS
+    LE = np.nan
+    H = np.nan
+    R_A = np.nan
+    n_iterations = 0
+    for n_iterations in range(max_iterations):
+        flag = TSEB.F_ALL_FLUXES_OS
+        if L_diff < TSEB.L_thres:
+            break
+
+        R_A = _R_A(z_T, u_friction, L, d_0, z_0H)
+        H = rho * c_p * (Tr_K - T_A_K) / R_A
+        LE = Rn - G - H
+
+        # Avoid negative ET during daytime and make sure that energy is conserved
+        if LE < 0:
+            flag = TSEB.F_ZERO_LE_OS
+            H = np.minimum(H, Rn - G)
+            G = np.maximum(G, Rn - H)
+            LE = 0.0
+
+        L = _mo_length(u_friction, T_A_K, rho, c_p, H, LE, Lambda)
+        L_diff = np.fabs(L - L_old) / np.fabs(L_old)
+        L_old = L
+        if L_old == 0:
+            L_old = 1e-36
+        u_friction = _u_star(u, z_u, L, d_0, z_0M)
+
+    return float(flag), LE, H, G, R_A, u_friction, L, float(n_iterations)
+
+
+@_jit
+def _tseb_pt_point(Tr_K, T_A_K, u, p, Sn_C, Sn_S, L_dn, LAI, h_C, emis_C, emis_S, z_0M, d_0,
+                   z_u, z_T, leaf_width, z0_soil, alpha_PT, f_g, KN_b, KN_c, KN_C_dash,
+                   rho, c_p, z_0H, Lambda, f_theta, albl, taudl, s_gama, a_goudriaan,
+                   res_form, G_form, G_param, G_coef, max_iterations):
+
+    nan = np.nan
+    Ln_S = Ln_C = LE_C = H_C = LE_S = H_S = G = R_S = R_x = R_A = n_iterations = nan
+    L = np.inf
+    u_friction = _u_star(u, z_u, L, d_0, z_0M)
+    if np.isnan(Tr_K) or np.isnan(T_A_K):
+        T_C = nan
+    else:
+        T_C = min(Tr_K, T_A_K)
+    flag, T_S = _calc_T_S(Tr_K, T_C, f_theta)
+    T_AC = T_A_K
+
+    # History of the last Monin-Obukhov lengths to detect oscillations between
+    # 2 or 3 steady state values
+    L_queue = np.empty(6)
+    L_queue[0] = np.float32(L)
+    n_queue = 1
+    L_converged = False
+
+    alpha_PT = np.float32(alpha_PT)
+    for iteration in range(max_iterations):
+        if L_converged or flag == TSEB.F_INVALID:
+            break
+        n_iterations = float(iteration)
+
+        # Inner loop to iterativelly reduce alpha_PT in case latent heat flux
+        # from the soil is negative. The initial assumption is of potential
+        # canopy transpiration.
+        flag = TSEB.F_ALL_FLUXES
+        LE_S = -1.0
+        alpha_PT_rec = np.float32(alpha_PT + np.float32(0.1))
+        while LE_S < 0:
+            alpha_PT_rec = np.float32(alpha_PT_rec - np.float32(0.1))
+            # There cannot be negative transpiration from the vegetation
+            if alpha_PT_rec <= 0.0:
+                alpha_PT_rec = np.float32(0.0)
+                flag = TSEB.F_ZERO_LE
+            elif alpha_PT_rec < alpha_PT:
+                flag = TSEB.F_ZERO_LE_S
+
+            # Calculate aerodynamic resistances
+            R_A = _R_A(z_T, u_friction, L, d_0, z_0H)
+            R_x, R_S = _R_x_R_S(res_form, u_friction, h_C, d_0, z_0M, L, LAI, leaf_width,
+                                z0_soil, a_goudriaan, T_S - T_AC, KN_b, KN_c, KN_C_dash)
+
+            # Calculate net longwave radiation with current values of T_C and T_S
+            L_C = emis_C * met.sb * T_C**4
+            if np.isnan(L_C):
+                L_C = 0.0
+            L_S = emis_S * met.sb * T_S**4
+            if np.isnan(L_S):
+                L_S = 0.0
+            Ln_S = emis_S * taudl * L_dn + emis_S * (1.0 - taudl) * L_C - L_S
+            Ln_C = (1 - albl) * (1.0 - taudl) * (L_dn + L_S) - 2.0 * (1.0 - taudl) * L_C
+            if np.isnan(Ln_S):
+                Ln_S = 0.0
+            if np.isnan(Ln_C):
+                Ln_C = 0.0
+            delta_Rn = Sn_C + Ln_C
+            Rn_S = Sn_S + Ln_S
+
+            # Calculate the canopy and soil temperatures using the Priestley
+            # Taylor appoach
+            H_C = delta_Rn * (1.0 - alpha_PT_rec * f_g * s_gama)
+            T_C = _calc_T_C_series(Tr_K, T_A_K, R_A, R_x, R_S, f_theta, H_C, rho, c_p)
+            flag_t, T_S = _calc_T_S(Tr_K, T_C, f_theta)
+
+            # Recalculate soil resistance using new soil temperature
+            _, R_S = _R_x_R_S(res_form, u_friction, h_C, d_0, z_0M, L, LAI, leaf_width, z0_soil,
+                              a_goudriaan, T_S - T_AC, KN_b, KN_c, KN_C_dash)
+            if flag_t == TSEB.F_INVALID:
+                flag = TSEB.F_INVALID
+                LE_S = 0.0
+                break
+
+            # Get air temperature at canopy interface
+            T_AC = ((T_A_K / R_A + T_S / R_S + T_C / R_x)
+                    / (1.0 / R_A + 1.0 / R_S + 1.0 / R_x))
+
+            # Calculate soil fluxes
+            H_S = rho * c_p * (T_S - T_AC) / R_S
+            G = _calc_G(G_form, G_param, G_coef, Rn_S)
+
+            # Estimate latent heat fluxes as residual of energy balance at the
+            # soil and the canopy
+            LE_S = Rn_S - G - H_S
+            LE_C = delta_Rn - H_C
+
+            # Special case if there is no transpiration from vegetation.
+            # In that case, there should also be no evaporation from the soil
+            # and the energy at the soil should be conserved.
+            # See end of appendix A1 in Guzinski et al. (2015).
+            if LE_C == 0:
+                H_S = np.minimum(H_S, Rn_S - G)
+                G = np.maximum(G, Rn_S - H_S)
+                LE_S = 0.0
+
+            # Now L can be recalculated and the friction velocity with the new
+            # stability correction
+            L = _mo_length(u_friction, T_A_K, rho, c_p, H_C + H_S, LE_C + LE_S, Lambda)
+            u_friction = _u_star(u, z_u, L, d_0, z_0M)
+
+        # We check convergence against the value of L from previous iteration but as well
+        # against values from 2 or 3 iterations back.
+        for k in range(min(n_queue, 5), 0, -1):
+            L_queue[k] = L_queue[k - 1]
+        n_queue = min(n_queue + 1, 6)
+        L_queue[0] = np.float32(L)
+        if L_queue[0] == 0:
+            L_queue[0] = 1e-36
+        if flag == TSEB.F_INVALID:
+            continue
+        L_converged = _L_diff(L_queue[0], L_queue[1]) < TSEB.L_thres
+        if not L_converged and n_queue >= 4:
+            L_converged = (_L_diff(L_queue[0], L_queue[2]) < TSEB.L_thres
+                           and _L_diff(L_queue[1], L_queue[3]) < TSEB.L_thres)
+        if not L_converged and n_queue == 6:
+            L_converged = (_L_diff(L_queue[0], L_queue[3]) < TSEB.L_thres
+                           and _L_diff(L_queue[1], L_queue[4]) < TSEB.L_thres
+                           and _L_diff(L_queue[2], L_queue[5]) < TSEB.L_thres)
+
+    return (float(flag), T_S, T_C, T_AC, Ln_S, Ln_C, LE_C, H_C, LE_S, H_S, G, R_S, R_x, R_A,
+            u_friction, L, n_iterations)
+
+
+@_jit
+def _calc_T_C_series(Tr_K, T_A_K, R_A, R_x, R_S, f_theta, H_C, rho, c_p):
+    # See TSEB.calc_T_C_series
+    T_C_lin = ((T_A_K / R_A + Tr_K / (R_S * (1.0 - f_theta))
+                + H_C * R_x / (rho * c_p) * (1.0 / R_A + 1.0 / R_S + 1.0 / R_x))
+               / (1.0 / R_A + 1.0 / R_S + f_theta / (R_S * (1.0 - f_theta))))
+    T_D = (T_C_lin * (1 + R_S / R_A) - H_C * R_x / (rho * c_p)
+           * (1.0 + R_S / R_x + R_S / R_A) - T_A_K * R_S / R_A)
+    delta_T_C = ((Tr_K**4 - f_theta * T_C_lin**4 - (1.0 - f_theta) * T_D**4)
+                 / (4.0 * (1.0 - f_theta) * T_D**3 * (1.0 + R_S / R_A)
+                    + 4.0 * f_theta * T_C_lin**3))
+    return T_C_lin + delta_T_C
+
+
+# ==============================================================================
+# Loops over all pixels
+# ==============================================================================
+@_parallel_jit
+def _oseb_array(Tr_K, T_A_K, u, z_0M, d_0, z_u, z_T, rho, c_p, z_0H, Lambda, Rn, G,
+                max_iterations, mask, out):
+
+    for j in _prange(Tr_K.size):
+        if not mask[j]:
+            continue
+        result = _oseb_point(Tr_K[j], T_A_K[j], u[j], z_0M[j], d_0[j], z_u[j], z_T[j], rho[j],
+                             c_p[j], z_0H[j], Lambda[j], Rn[j], G[j], max_iterations)
+        for k in range(8):
+            out[k][j] = result[k]
+
+
+@_parallel_jit
+def _tseb_pt_array(Tr_K, T_A_K, u, p, Sn_C, Sn_S, L_dn, LAI, h_C, emis_C, emis_S, z_0M, d_0,
+                   z_u, z_T, leaf_width, z0_soil, alpha_PT, f_g, KN_b, KN_c, KN_C_dash,
+                   rho, c_p, z_0H, Lambda, f_theta, albl, taudl, s_gama, a_goudriaan,
+                   res_form, G_form, G_param, G_coef, max_iterations, mask, out):
+
+    for j in _prange(Tr_K.size):
+        if not mask[j]:
+            continue
+        result = _tseb_pt_point(Tr_K[j], T_A_K[j], u[j], p[j], Sn_C[j], Sn_S[j], L_dn[j],
+                                LAI[j], h_C[j], emis_C[j], emis_S[j], z_0M[j], d_0[j], z_u[j],
+                                z_T[j], leaf_width[j], z0_soil[j], alpha_PT[j], f_g[j],
+                                KN_b[j], KN_c[j], KN_C_dash[j], rho[j], c_p[j], z_0H[j],
+                                Lambda[j], f_theta[j], albl[j], taudl[j], s_gama[j],
+                                a_goudriaan[j], res_form, G_form, G_param[j], G_coef,
+                                max_iterations)
+        for k in range(17):
+            out[k][j] = result[k]
+
+
+@_parallel_jit
+def _diffuse_split_array(S_dn, difvis, difnir, fvis, fnir, Skyl, S_dn_dir, S_dn_dif):
+
+    for j in _prange(S_dn.size):
+        Skyl[j] = difvis[j] * fvis[j] + difnir[j] * fnir[j]
+        S_dn_dir[j] = S_dn[j] * (1.0 - Skyl[j])
+        S_dn_dif[j] = S_dn[j] * Skyl[j]
+
+
+def _use_kernel(const_L):
+    # The compiled kernels neither force L nor clip the stability parameter
+    return (USE_NUMBA and const_L is None
+            and MO.UNSTABLE_THRES is None and MO.STABLE_THRES is None)
+
+
+def _flat_inputs(shape, *arrays):
+    # Contiguous 1-D float32 arrays, so that the kernels are compiled for a single signature and
+    # read their inputs with unit stride. Arrays already in this layout are not copied
+    return [np.ascontiguousarray(np.broadcast_to(a, shape), dtype=np.float32).reshape(-1)
+            for a in arrays]
+
+
+def _pixel_mask(mask, shape):
+    # Flat boolean array of the pixels to solve
+    if mask is None:
+        return np.ones(int(np.prod(shape)), bool)
+    return np.ravel(np.broadcast_to(np.asarray(mask, dtype=bool), shape))
+
+
+def _output_arrays(out, n_outputs, shape, flag_fill):
+    # Arrays where the model outputs are written. New arrays are NaN, and their flag is flag_fill
+    if out is None:
+        out = [np.full(shape, flag_fill if k == 0 else np.NaN, np.float32)
+               for k in range(n_outputs)]
+    return out
+
+
+def _run_kernel(kernel, args, out):
+    # The kernels write each output straight into its array when it is a contiguous float32
+    # array, otherwise into a temporary copy that is then written back
+    flat = tuple(np.require(a, np.float32, 'C').reshape(-1) for a in out)
+    kernel(*args, flat)
+    for a, b in zip(out, flat):
+        if not np.may_share_memory(a, b):
+            a[...] = b.reshape(a.shape)
+
+
+def _select_pixels(value, idx, shape):
+    # Pixels idx of the inputs with the shape of the image. Scalars are kept and the nested
+    # parameter lists and dictionaries are searched for per pixel arrays
+    if isinstance(value, dict):
+        return {k: _select_pixels(v, idx, shape) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_select_pixels(v, idx, shape) for v in value)
+    if np.shape(value) == shape:
+        return np.asarray(value).reshape(-1)[idx]
+    return value
+
+
+def _run_on_pixels(model, mask, shape, args, kwargs, out):
+    # Runs the model only on the pixels in mask, and scatters its outputs into the out
+    # arrays. Pixels outside the mask are not modified
+    idx = np.flatnonzero(_pixel_mask(mask, shape))
+    if idx.size == 0:
+        return tuple(out)
+    if idx.size == np.prod(shape):
+        for array, value in zip(out, model(*args, **kwargs)):
+            array[...] = value
+    else:
+        values = model(*_select_pixels(args, idx, shape), **_select_pixels(kwargs, idx, shape))
+        for array, value in zip(out, values):
+            np.put(array, idx, value)
+    return tuple(out)
+
+
+def _G_coefficients(calcG_params):
+    # Shared parameters of the time dependent soil heat flux formulations
+    G_coef = np.ones(6)
+    G_coef[:len(calcG_params[0]) - 1] = calcG_params[0][1:]
+    return int(calcG_params[0][0]), G_coef
+
+
+# ==============================================================================
+# Model wrappers
+# ==============================================================================
+def calc_diffuse_split(S_dn, difvis, difnir, fvis, fnir):
+    '''Splits the incoming shortwave irradiance into its direct and diffuse components.
+
+    The skyl ratio and both components are computed in a single pass over the pixels,
+    or with in-place NumPy operations when Numba is not available.
+
+    Parameters
+    ----------
+    S_dn : float or array
+        Incoming shortwave irradiance (W m-2).
+    difvis, difnir : float or array
+        Diffuse fraction of the visible and NIR irradiance, see
+        :func:`~net_radiation.calc_difuse_ratio`.
+    fvis, fnir : float or array
+        Fraction of the total irradiance in the visible and NIR.
+
+    Returns
+    -------
+    Skyl : float32 array
+        Diffuse fraction of the total shortwave irradiance.
+    S_dn_dir : float32 array
+        Direct shortwave irradiance (W m-2).
+    S_dn_dif : float32 array
+        Diffuse shortwave irradiance (W m-2).
+    '''
+
+    S_dn, difvis, difnir, fvis, fnir = np.broadcast_arrays(S_dn, difvis, difnir, fvis, fnir)
+    Skyl, S_dn_dir, S_dn_dif = [np.empty(S_dn.shape, np.float32) for i in range(3)]
+    if USE_NUMBA:
+        _diffuse_split_array(*_flat_inputs(S_dn.shape, S_dn, difvis, difnir, fvis, fnir),
+                             Skyl.reshape(-1), S_dn_dir.reshape(-1), S_dn_dif.reshape(-1))
+    else:
+        np.multiply(difvis, fvis, out=Skyl)
+        Skyl += difnir * fnir
+        np.subtract(1.0, Skyl, out=S_dn_dir)
+        S_dn_dir *= S_dn
+        np.multiply(S_dn, Skyl, out=S_dn_dif)
+    return Skyl, S_dn_dir, S_dn_dif
+
+
+def OSEB(Tr_K,
+         T_A_K,
+         u,
+         ea,
+         p,
+         Sn,
+         L_dn,
+         emis,
+         z_0M,
+         d_0,
+         z_u,
+         z_T,
+         calcG_params=[
+             [1],
+             0.35],
+         const_L=None,
+         T0_K=[],
+         kB=TSEB.KB_1_DEFAULT,
+         mask=None,
+         out=None):
+    '''Calulates bulk fluxes from a One Source Energy Balance model, see :func:`~TSEB.OSEB`.
+
+    Unlike :func:`~TSEB.OSEB` the iterations are stopped independently for each pixel.
+    :func:`~TSEB.OSEB` is used when Numba is not available or when const_L or T0_K are set.
+
+    Parameters
+    ----------
+    mask : bool array, optional
+        Pixels to process, all of them if None.
+    out : list of arrays, optional
+        Arrays with the shape of Tr_K where the outputs of the pixels in mask are written, in
+        the order they are returned. New arrays are created if None.
+
+    Returns
+    -------
+    flag, Ln, LE, H, G, R_A, u_friction, L, n_iterations : array
+        Same outputs as :func:`~TSEB.OSEB`.
+    '''
+
+    out = _output_arrays(out, 9, np.shape(Tr_K), np.NaN)
+    args = (Tr_K, T_A_K, u, ea, p, Sn, L_dn, emis, z_0M, d_0, z_u, z_T)
+    kwargs = dict(calcG_params=calcG_params, const_L=const_L, T0_K=T0_K, kB=kB)
+    if not _use_kernel(const_L) or len(T0_K) == 2:
+        return _run_on_pixels(TSEB.OSEB, mask, np.shape(Tr_K), args, kwargs, out)
+    if not np.all(_pixel_mask(mask, np.shape(Tr_K))):
+        # Compact the inputs to the pixels in mask first, so that the pixels outside the mask
+        # are neither preprocessed nor solved
+        return _run_on_pixels(OSEB, mask, np.shape(Tr_K), args, kwargs, out)
+
+    # Convert input scalars to numpy arrays and check parameters size
+    Tr_K = np.asarray(Tr_K)
+    (T_A_K,
+     u,
+     ea,
+     p,
+     Sn,
+     L_dn,
+     emis,
+     z_0M,
+     d_0,
+     z_u,
+     z_T,
+     calcG_array) = map(TSEB._check_default_parameter_size,
+                        [T_A_K, u, ea, p, Sn, L_dn, emis, z_0M, d_0, z_u, z_T, calcG_params[1]],
+                        [Tr_K] * 12)
+
+    # Calculate the parameters which do not change during the iterations
+    rho = met.calc_rho(p, ea, T_A_K)
+    c_p = met.calc_c_p(p, ea)
+    z_0H = res.calc_z_0H(z_0M, kB=kB)
+    Lambda = met.calc_lambda(T_A_K)
+    Ln = emis * L_dn - emis * met.calc_stephan_boltzmann(Tr_K)
+    Rn = np.asarray(Sn + Ln)
+    G = TSEB.calc_G([calcG_params[0], calcG_array], Rn).reshape(Tr_K.shape)
+    mask = _pixel_mask(mask, Tr_K.shape)
+
+    _run_kernel(_oseb_array,
+                (*_flat_inputs(Tr_K.shape, Tr_K, T_A_K, u, z_0M, d_0, z_u, z_T, rho, c_p, z_0H,
+                               Lambda, Rn, G),
+                 TSEB.ITERATIONS, mask),
+                out[:1] + out[2:])
+    np.copyto(out[1], Ln, where=mask.reshape(Tr_K.shape))
+
+    return tuple(out)
+
+
+def TSEB_PT(Tr_K,
+            vza,
+            T_A_K,
+            u,
+            ea,
+            p,
+            Sn_C,
+            Sn_S,
+            L_dn,
+            LAI,
+            h_C,
+            emis_C,
+            emis_S,
+            z_0M,
+            d_0,
+            z_u,
+            z_T,
+            leaf_width=0.1,
+            z0_soil=0.01,
+            alpha_PT=1.26,
+            x_LAD=1,
+            f_c=1.0,
+            f_g=1.0,
+            w_C=1.0,
+            resistance_form=[0, {}],
+            calcG_params=[
+                [1],
+                0.35],
+            const_L=None,
+            kB=TSEB.KB_1_DEFAULT,
+            mask=None,
+            out=None):
+    '''Priestley-Taylor TSEB, see :func:`~TSEB.TSEB_PT`.
+
+    :func:`~TSEB.TSEB_PT` is used when Numba is not available, when const_L is set or for
+    the HADHIGHI_AND_OR_2015 resistance formulation.
+
+    Parameters
+    ----------
+    mask : bool array, optional
+        Pixels to process, all of them if None.
+    out : list of arrays, optional
+        Arrays with the shape of Tr_K where the outputs of the pixels in mask are written, in
+        the order they are returned. New arrays are created if None.
+
+    Returns
+    -------
+    flag, T_S, T_C, T_AC, L_nS, L_nC, LE_C, H_C, LE_S, H_S, G, R_S, R_x, R_A, u_friction, L,
+    n_iterations : array
+        Same outputs as :func:`~TSEB.TSEB_PT`.
+    '''
+
+    out = _output_arrays(out, 17, np.shape(Tr_K), TSEB.F_INVALID)
+    args = (Tr_K, vza, T_A_K, u, ea, p, Sn_C, Sn_S, L_dn, LAI, h_C, emis_C, emis_S, z_0M, d_0,
+            z_u, z_T)
+    kwargs = dict(leaf_width=leaf_width, z0_soil=z0_soil, alpha_PT=alpha_PT, x_LAD=x_LAD,
+                  f_c=f_c, f_g=f_g, w_C=w_C, resistance_form=resistance_form,
+                  calcG_params=calcG_params, const_L=const_L, kB=kB)
+    if not _use_kernel(const_L) or resistance_form[0] not in RESISTANCE_FORMS:
+        return _run_on_pixels(TSEB.TSEB_PT, mask, np.shape(Tr_K), args, kwargs, out)
+    if not np.all(_pixel_mask(mask, np.shape(Tr_K))):
+        # Compact the inputs to the pixels in mask first, so that the pixels outside the mask
+        # are neither preprocessed nor solved
+        return _run_on_pixels(TSEB_PT, mask, np.shape(Tr_K), args, kwargs, out)
+
+    # Convert input float scalars to arrays and parameters size
+    Tr_K = np.asarray(Tr_K, dtype=np.float32)
+    res_params = resistance_form[1]
+    (vza,
+     T_A_K,
+     u,
+     ea,
+     p,
+     Sn_C,
+     Sn_S,
+     L_dn,
+     LAI,
+     h_C,
+     emis_C,
+     emis_S,
+     z_0M,
+     d_0,
+     z_u,
+     z_T,
+     leaf_width,
+     z0_soil,
+     alpha_PT,
+     x_LAD,
+     f_c,
+     f_g,
+     w_C,
+     KN_b,
+     KN_c,
+     KN_C_dash,
+     calcG_array) = map(TSEB._check_default_parameter_size,
+                        [vza, T_A_K, u, ea, p, Sn_C, Sn_S, L_dn, LAI, h_C, emis_C, emis_S, z_0M,
+                         d_0, z_u, z_T, leaf_width, z0_soil, alpha_PT, x_LAD, f_c, f_g, w_C,
+                         res_params.get("KN_b", res.KN_b),
+                         res_params.get("KN_c", res.KN_c),
+                         res_params.get("KN_C_dash", res.KN_C_dash),
+                         calcG_params[1]],
+                        [Tr_K] * 27)
+
+    # Calculate the parameters which do not change during the iterations
+    rho = met.calc_rho(p, ea, T_A_K)
+    c_p = met.calc_c_p(p, ea)
+    z_0H = res.calc_z_0H(z_0M, kB=kB)
+    Lambda = met.calc_lambda(T_A_K)
+    omega0 = CI.calc_omega0_Kustas(LAI, f_c, x_LAD=x_LAD, isLAIeff=True)
+    F = np.asarray(LAI / f_c, dtype=np.float32)
+    f_theta = TSEB.calc_F_theta_campbell(vza, F, w_C=w_C, Omega0=omega0, x_LAD=x_LAD)
+    # Longwave canopy transmittance and albedo
+    _, albl, _, taudl = rad.calc_spectra_Cambpell(LAI,
+                                                  np.zeros(emis_C.shape),
+                                                  1.0 - emis_C,
+                                                  np.zeros(emis_C.shape),
+                                                  1.0 - emis_S,
+                                                  x_lad=x_LAD,
+                                                  lai_eff=None)
+    # Priestley-Taylor slope term, see TSEB.calc_H_C_PT
+    s = met.calc_delta_vapor_pressure(T_A_K) * 10
+    gama = met.calc_psicr(c_p, p, Lambda)
+    s_gama = s / (s + gama)
+    a_goudriaan = wnd.calc_A_Goudriaan(h_C, LAI, leaf_width)
+    G_form, G_coef = _G_coefficients(calcG_params)
+    mask = _pixel_mask(mask, Tr_K.shape)
+
+    _run_kernel(_tseb_pt_array,
+                (*_flat_inputs(Tr_K.shape, Tr_K, T_A_K, u, p, Sn_C, Sn_S, L_dn, LAI, h_C, emis_C,
+                               emis_S, z_0M, d_0, z_u, z_T, leaf_width, z0_soil, alpha_PT, f_g,
+                               KN_b, KN_c, KN_C_dash, rho, c_p, z_0H, Lambda, f_theta, albl,
+                               taudl, s_gama, a_goudriaan),
+                 int(resistance_form[0]), G_form, *_flat_inputs(Tr_K.shape, calcG_array), G_coef,
+                 TSEB.ITERATIONS, mask),
+                out)
+
+    return tuple(out)
@@ -155,7 +155,7 @@ def penman_monteith(T_A_K,
                       [T_A_K] * 14)
 
     # Create the output variables
-    [flag, Ln, LE, H, G, R_A, iterations] = [np.zeros(T_A_K.shape, np.float32) + np.NaN for i in
+    [flag, Ln, LE, H, G, R_A, iterations] = [np.full(T_A_K.shape, np.NaN, np.float32) for i in
                                              range(7)]
 
     # Calculate the general parameters
@@ -881,7 +881,7 @@ def penman(T_A_K,
                       [T_A_K] * 11)
 
     # Create the output variables
-    [flag, Ln, LE, H, G, R_A, iterations] = [np.zeros(T_A_K.shape, np.float32) + np.NaN for i in
+    [flag, Ln, LE, H, G, R_A, iterations] = [np.full(T_A_K.shape, np.NaN, np.float32) for i in
                                              range(7)]
 
     # Calculate the general parameters
@@ -43,12 +43,16 @@ LONG_DESCRIPTION = read_file("README.md")
 SHORT_DESCRIPTION = "Two Source Energy Balance (TSEB) Models to estimate sensible and latent heat flux (evapotranspiration) from radiometric surface temperature data"
 REQS = ['numpy>=1.10', 'gdal', 'bokeh', 'pandas', 'netCDF4',
         "pypro4sail"]
+# Optional dependencies: compiled energy balance solvers and faster parsing of tabulated inputs
+EXTRAS = {"numba": ["numba"],
+          "pyarrow": ["pyarrow"]}
 
 
 setup(
     name                  = "pyTSEB",
     packages              = ['pyTSEB'],
     install_requires      = REQS,
+    extras_require        = EXTRAS,
     version               = "2.1",
     author                = "Hector Nieto",
     author_email          = "hector.nieto.solana@gmail.com",
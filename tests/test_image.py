@@ -1,8 +1,12 @@
 import os
+import threading
 
+import numpy as np
+import pytest
 import rasterio
 import numpy.testing as npt
 
+from pyTSEB import PyTSEB
 from pyTSEB.TSEBConfigFileInterface import TSEBConfigFileInterface
 
 
@@ -35,3 +39,180 @@ def test_image_nodiff():
 
     os.remove(IMG_OUT_PATH)
     os.remove(ANC_IMG_OUT_PATH)
+
+
+def _run_image(output_file):
+    setup = TSEBConfigFileInterface()
+    config_data = setup.parse_input_config(TEST_CONFIG, is_image=True)
+    config_data.set('top', 'output_file', str(output_file))
+    setup.get_data(config_data, is_image=True)
+    setup.run(is_image=True)
+
+
+def _read_image(path):
+    with rasterio.open(path) as src:
+        return src.read()
+
+
+def test_image_blocks(monkeypatch, tmp_path):
+    # An image processed as many small blocks in parallel processes gives the same outputs as
+    # when it is processed as a single block
+    monkeypatch.setattr(PyTSEB, "BLOCK_PROCESSES", 1)
+    _run_image(tmp_path / 'single.tif')
+
+    monkeypatch.setattr(PyTSEB, "BLOCK_PIXELS", 5000)
+    monkeypatch.setattr(PyTSEB, "OUTPUT_BLOCK_SIZE", 16)
+    monkeypatch.setattr(PyTSEB, "BLOCK_PROCESSES", 2)
+    _run_image(tmp_path / 'blocks.tif')
+
+    npt.assert_array_equal(_read_image(tmp_path / 'blocks.tif'),
+                           _read_image(tmp_path / 'single.tif'))
+    assert not list(tmp_path.glob('*_tmp.tif'))
+
+
+def test_image_write_error(monkeypatch, tmp_path):
+    # The temporary outputs are deleted if the image cannot be processed
+    def write_error(*args):
+        raise RuntimeError("write error")
+
+    monkeypatch.setattr(PyTSEB.PyTSEB, "_write_output_blocks", write_error)
+    with pytest.raises(RuntimeError):
+        _run_image(tmp_path / 'test_image.tif')
+    assert not list(tmp_path.glob('*_tmp.tif'))
+
+
+def _model():
+    return PyTSEB.PyTSEB({'model': 'TSEB_PT', 'resistance_form': 0, 'G_form': [[1], 0.35],
+                          'water_stress': False})
+
+
+def _bare_soil_inputs(model, shape):
+    # Plausible inputs for every field of the model, without any vegetation
+    in_data = {field: np.full(shape, 1.0) for field in model._get_input_structure()}
+    in_data.update({field: np.full(shape, value) for field, value in
+                    [('LAI', 0.0), ('f_c', 0.0), ('S_dn', 600.0), ('SZA', 30.0),
+                     ('p', 1013.0), ('T_R0', 290.0), ('T_R1', 300.0), ('T_A1', 295.0),
+                     ('u', 3.0), ('ea', 15.0), ('L_dn', 350.0), ('emis_S', 0.95),
+                     ('z_u', 10.0), ('z_T', 10.0), ('z0_soil', 0.01),
+                     ('rho_vis_S', 0.15), ('rho_nir_S', 0.25), ('rho_vis_C', 0.07),
+                     ('tau_vis_C', 0.08), ('rho_nir_C', 0.32), ('tau_nir_C', 0.33),
+                     ('emis_C', 0.98), ('leaf_width', 0.1)]})
+    return in_data
+
+
+@pytest.mark.parametrize('model_class, called', [(PyTSEB.PyTSEB, False),
+                                                 (PyTSEB.PydisTSEB, True)])
+def test_bare_soil_image(monkeypatch, model_class, called):
+    # The vegetation model of PydisTSEB solves the whole image, so it has to be called even
+    # without vegetated pixels
+    model = model_class({'model': 'TSEB_PT', 'resistance_form': 0, 'G_form': [[1], 0.35],
+                         'water_stress': False, 'flux_LR_method': 'EF',
+                         'correct_LST': True})
+    calls = []
+    monkeypatch.setattr(model, '_call_flux_model_veg', lambda *args: calls.append(args))
+    model.run(_bare_soil_inputs(model, (4, 5)))
+    assert bool(calls) == called
+
+
+def test_invalid_temperature():
+    # The fluxes of the pixels without a valid temperature are not solved and flagged as invalid
+    model = _model()
+    in_data = _bare_soil_inputs(model, (4, 5))
+    in_data['LAI'][:, 0] = 2.0
+    in_data['f_c'][:, 0] = 0.6
+    in_data['T_R1'][0] = np.nan
+    out_data = model.run(in_data)
+    npt.assert_array_equal(out_data['flag'][0], PyTSEB.TSEB.F_INVALID)
+    assert np.all(np.isnan(out_data['LE1'][0]))
+    assert np.all(out_data['flag'][1:] != PyTSEB.TSEB.F_INVALID)
+    assert np.all(np.isfinite(out_data['LE1'][1:]))
+
+
+class _BlockedRaster(object):
+    ''' Stand-in for a GDAL dataset with the given block size.'''
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+
+    def GetRasterBand(self, band):
+        return self
+
+    def GetBlockSize(self):
+        return list(self.block_size)
+
+
+@pytest.mark.parametrize("block_size", [(256, 256), (512, 512), (300, 300), (20000, 1),
+                                        (1, 20000), (128, 16)])
+def test_iter_blocks(block_size):
+    # The windows tile the image, are aligned with the output tiles and never exceed the number
+    # of pixels processed at once
+    dims = (10000, 20000)
+    model = _model()
+    covered = np.zeros(dims, np.uint8)
+    for xoff, yoff, xsize, ysize in model._iter_blocks(_BlockedRaster(block_size), dims):
+        assert xsize * ysize <= PyTSEB.BLOCK_PIXELS
+        assert xoff % PyTSEB.OUTPUT_BLOCK_SIZE == 0 and yoff % PyTSEB.OUTPUT_BLOCK_SIZE == 0
+        covered[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+    assert np.all(covered == 1)
+
+
+def test_netcdf_main_thread(monkeypatch, tmp_path):
+    # libhdf5 is not thread safe, so the netCDF outputs are written by the main thread
+    threads = set()
+    write_output_blocks = PyTSEB.PyTSEB._write_output_blocks
+
+    def write_and_record(*args):
+        threads.add(threading.current_thread())
+        write_output_blocks(*args)
+
+    monkeypatch.setattr(PyTSEB, "BLOCK_PIXELS", 5000)
+    monkeypatch.setattr(PyTSEB, "BLOCK_PROCESSES", 1)
+    monkeypatch.setattr(PyTSEB.PyTSEB, "_write_output_blocks", write_and_record)
+    _run_image(tmp_path / 'test_image.nc')
+    assert threads == {threading.main_thread()}
+
+
+def _sparse_stack():
+    # Two fields with 16 pixel tiles, with a single valid pixel at the edge of two of the tiles
+    stack = np.full((2, 40, 50), np.NaN, np.float32)
+    stack[0, 15, 16] = 1.0
+    stack[1, 39, 49] = 2.0
+    return stack
+
+
+def test_valid_windows(monkeypatch):
+    monkeypatch.setattr(PyTSEB, "OUTPUT_BLOCK_SIZE", 16)
+    stack = _sparse_stack()
+    assert PyTSEB._valid_windows(np.full_like(stack, np.NaN)) == []
+    assert PyTSEB._valid_windows(np.zeros_like(stack)) == [(0, 0, 50, 40)]
+    assert PyTSEB._valid_windows(stack) == [(16, 0, 16, 16), (48, 32, 2, 8)]
+
+
+def test_sparse_output(monkeypatch, tmp_path):
+    # The tiles which are not written are read back as no data
+    monkeypatch.setattr(PyTSEB, "OUTPUT_BLOCK_SIZE", 16)
+    stack = _sparse_stack()
+    model = _model()
+    model.geo = (500000.0, 10.0, 0.0, 4500000.0, 0.0, -10.0)
+    model.prj = rasterio.crs.CRS.from_epsg(32630).to_wkt()
+    model.write_raster_output(str(tmp_path / 'sparse.tif'), {'H1': stack[0], 'LE1': stack[1]},
+                              ['H1', 'LE1'])
+    npt.assert_array_equal(_read_image(tmp_path / 'sparse.tif'), stack)
+    assert not list(tmp_path.glob('*_tmp.tif'))
+
+
+def test_vrt_output(tmp_path):
+    # The Virtual Raster Table stacks the fields saved in separate files
+    stack = np.arange(2 * 40 * 50, dtype=np.float32).reshape(2, 40, 50)
+    stack[:, :10, :10] = np.NaN
+    model = _model()
+    model.geo = (500000.0, 10.0, 0.0, 4500000.0, 0.0, -10.0)
+    model.prj = rasterio.crs.CRS.from_epsg(32630).to_wkt()
+    model.write_raster_output(str(tmp_path / 'test_image.vrt'),
+                              {'H1': stack[0], 'LE1': stack[1]}, ['H1', 'LE1'])
+    with rasterio.open(tmp_path / 'test_image.vrt') as src:
+        assert src.count == 2
+        assert src.descriptions == ('H1', 'LE1')
+        assert src.transform.to_gdal() == model.geo
+        assert src.crs == rasterio.crs.CRS.from_epsg(32630)
+        npt.assert_array_equal(src.read(), stack)
@@ -2,7 +2,9 @@ import os
 
 import numpy as np
 import numpy.testing as npt
+import pytest
 
+from pyTSEB import PyTSEB
 from pyTSEB.TSEBConfigFileInterface import TSEBConfigFileInterface
 
 
@@ -26,3 +28,15 @@ def test_csv_nodiff():
     npt.assert_allclose(new_data, old_data)
 
     os.remove(CSV_OUT_PATH)
+
+
+@pytest.mark.parametrize("table", ["year DOY\ttime\tT_R1\n2010 1\t12.5\t300.0\n",
+                                   "year\tDOY\ttime\tT_R1\t\n2010\t1\t12.5\t300.0\t\n"],
+                         ids=["mixed_delimiters", "trailing_tab"])
+def test_read_input_table(tmp_path, table):
+    # Tables whose header is not strictly tab delimited are read as whitespace delimited
+    input_file = tmp_path / 'input.txt'
+    input_file.write_text(table)
+    in_data = PyTSEB._read_input_table(str(input_file))
+    assert list(in_data.columns) == ['year', 'DOY', 'time', 'T_R1']
+    npt.assert_allclose(in_data.iloc[0], [2010, 1, 12.5, 300.0])
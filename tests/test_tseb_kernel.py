@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from pyTSEB import TSEB
+from pyTSEB import _tseb_kernel
+
+
+# The kernels are compared with the NumPy models whether they are compiled or not. Run the tests
+# once as they are and once with PYTSEB_DISABLE_NUMBA=1 to check both the compiled and the pure
+# Python kernels
+N_PIXELS = 500
+SEED = 42
+# Pixels close to a singular Monin-Obukhov length can converge to a different solution in
+# float32, allow for a few of them
+MAX_DIFFERENT_PIXELS = 0.01
+
+
+def _random_inputs(n=N_PIXELS, seed=SEED):
+    rng = np.random.default_rng(seed)
+
+    def uniform(low, high):
+        return rng.uniform(low, high, n).astype(np.float32)
+
+    h_C = uniform(0.2, 3.0)
+    return dict(Tr_K=uniform(285.0, 325.0),
+                vza=uniform(0.0, 40.0),
+                T_A_K=uniform(283.0, 305.0),
+                u=uniform(0.5, 8.0),
+                ea=uniform(5.0, 25.0),
+                p=uniform(950.0, 1013.0),
+                Sn_C=uniform(0.0, 450.0),
+                Sn_S=uniform(0.0, 350.0),
+                L_dn=uniform(280.0, 420.0),
+                LAI=uniform(0.2, 5.0),
+                h_C=h_C,
+                emis_C=np.full(n, 0.98, np.float32),
+                emis_S=np.full(n, 0.95, np.float32),
+                z_0M=h_C * np.float32(0.125),
+                d_0=h_C * np.float32(0.65),
+                z_u=np.full(n, 10.0, np.float32),
+                z_T=np.full(n, 10.0, np.float32),
+                f_c=uniform(0.2, 1.0),
+                f_g=uniform(0.5, 1.0),
+                w_C=uniform(0.5, 2.0),
+                leaf_width=uniform(0.02, 0.2),
+                z0_soil=uniform(0.005, 0.05))
+
+
+def _tseb_pt_args(inputs, resistance_form):
+    args = [inputs[field] for field in ['Tr_K', 'vza', 'T_A_K', 'u', 'ea', 'p', 'Sn_C', 'Sn_S',
+                                        'L_dn', 'LAI', 'h_C', 'emis_C', 'emis_S', 'z_0M', 'd_0',
+                                        'z_u', 'z_T']]
+    kwargs = {field: inputs[field] for field in ['leaf_width', 'z0_soil', 'f_c', 'f_g', 'w_C']}
+    kwargs['resistance_form'] = [resistance_form, {}]
+    kwargs['calcG_params'] = [[1], np.full(N_PIXELS, 0.35, np.float32)]
+    return args, kwargs
+
+
+def _oseb_args(inputs):
+    args = [inputs[field] for field in ['Tr_K', 'T_A_K', 'u', 'ea', 'p', 'Sn_S', 'L_dn',
+                                        'emis_S']]
+    args += [inputs['z0_soil'], np.zeros(N_PIXELS, np.float32), inputs['z_u'], inputs['z_T']]
+    kwargs = {'calcG_params': [[1], np.full(N_PIXELS, 0.35, np.float32)]}
+    return args, kwargs
+
+
+def _assert_mostly_close(new, old, n_outputs):
+    assert len(new) == len(old) == n_outputs
+    # The kernels stop iterating each pixel once it converges, and the NumPy models once all the
+    # pixels converge, so the last output, the number of iterations, is not compared
+    different = np.zeros(N_PIXELS, bool)
+    for new_value, old_value in zip(new[:-1], old[:-1]):
+        different |= ~np.isclose(new_value, old_value, rtol=1e-3, atol=1e-2, equal_nan=True)
+    assert different.sum() <= MAX_DIFFERENT_PIXELS * N_PIXELS
+
+
+def _oseb_outputs(outputs):
+    # TSEB.OSEB resets the flags of all the pixels once all of them converge, and the kernels
+    # reset the flag of each pixel once it converges. So a pixel where LE was set to zero may
+    # keep F_ZERO_LE_OS in one of them only, depending on the convergence of the other pixels
+    flag = np.array(outputs[0])
+    flag[flag == TSEB.F_ZERO_LE_OS] = TSEB.F_ALL_FLUXES_OS
+    return (flag,) + tuple(outputs[1:])
+
+
+@pytest.mark.parametrize("resistance_form", _tseb_kernel.RESISTANCE_FORMS)
+def test_tseb_pt_kernel(monkeypatch, resistance_form):
+    args, kwargs = _tseb_pt_args(_random_inputs(), resistance_form)
+    old = TSEB.TSEB_PT(*args, **kwargs)
+    monkeypatch.setattr(_tseb_kernel, "USE_NUMBA", True)
+    new = _tseb_kernel.TSEB_PT(*args, **kwargs)
+    _assert_mostly_close(new, old, 17)
+
+
+def test_oseb_kernel(monkeypatch):
+    args, kwargs = _oseb_args(_random_inputs())
+    old = TSEB.OSEB(*args, **kwargs)
+    monkeypatch.setattr(_tseb_kernel, "USE_NUMBA", True)
+    new = _tseb_kernel.OSEB(*args, **kwargs)
+    _assert_mostly_close(_oseb_outputs(new), _oseb_outputs(old), 9)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_masked_pixels(monkeypatch, use_numba):
+    # Only the pixels in the mask are solved, the outputs elsewhere are left untouched
+    monkeypatch.setattr(_tseb_kernel, "USE_NUMBA", use_numba)
+    mask = np.random.default_rng(SEED).random(N_PIXELS) < 0.5
+    for model, (args, kwargs), n_outputs, outputs in (
+            (_tseb_kernel.TSEB_PT,
+             _tseb_pt_args(_random_inputs(), TSEB.KUSTAS_NORMAN_1999), 17, tuple),
+            (_tseb_kernel.OSEB, _oseb_args(_random_inputs()), 9, _oseb_outputs)):
+        full = model(*args, **kwargs)
+        out = [np.full(N_PIXELS, -1, np.float32) for k in range(n_outputs)]
+        masked = model(*args, mask=mask, out=out, **kwargs)
+        assert all(np.all(value[~mask] == -1) for value in masked)
+        for value in masked:
+            value[~mask] = np.NaN
+        for value in full:
+            value[~mask] = np.NaN
+        _assert_mostly_close(outputs(masked), outputs(full), n_outputs)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test_masked_bare_soil(monkeypatch, use_numba):
+    # The pixels outside the mask are not preprocessed, so a zero vegetation cover there does not
+    # raise a division by zero
+    monkeypatch.setattr(_tseb_kernel, "USE_NUMBA", use_numba)
+    inputs = _random_inputs()
+    mask = inputs['f_c'] > 0.5
+    inputs['f_c'][~mask] = 0
+    args, kwargs = _tseb_pt_args(inputs, TSEB.KUSTAS_NORMAN_1999)
+    with np.errstate(divide='raise'):
+        outputs = _tseb_kernel.TSEB_PT(*args, mask=mask, **kwargs)
+    assert np.all(outputs[0][~mask] == TSEB.F_INVALID)
+    assert np.all(outputs[0][mask] != TSEB.F_INVALID)